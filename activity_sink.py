@@ -0,0 +1,130 @@
+"""Buffered, asynchronous writer for the activities log.
+
+Nothing reads an activity in the request that produced it, so handlers
+hand events to an ActivitySink instead of waiting on insert_one. A
+background thread writes them with insert_many whenever max_batch events
+are queued or flush_interval seconds have passed. The queue is bounded:
+when it is full, record() blocks for at most put_timeout and then drops
+the event and counts it. Pending events are flushed at interpreter exit.
+The writer thread starts with the first event recorded in a process, so
+nothing runs at import time or before a pre-fork server forks. on_write,
+if given, is called with each batch after it has been stored.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ActivitySink:
+    def __init__(self, collection, max_batch=100, flush_interval=1.0, max_queue=10000, put_timeout=0.05,
+                 on_write=None):
+        self.collection = collection
+        self.on_write = on_write
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.flushed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._write_lock = threading.Lock()
+        self._counter_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._thread = threading.Thread(target=self._run, name='activity-sink', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+            atexit.register(self.close)
+
+    def record(self, activity):
+        """Queue an activity document. Returns False if it had to be dropped."""
+        self._ensure_started()
+        try:
+            self._queue.put(activity, timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            with self._counter_lock:
+                self.dropped += 1
+            logger.warning(f"Activity queue full, dropped {activity.get('category')}/{activity.get('action')}")
+            return False
+
+    def _write(self, batch):
+        if not batch:
+            return
+        with self._write_lock:
+            try:
+                self.collection.insert_many(batch, ordered=False)
+                self.flushed += len(batch)
+                self.batches += 1
+            except Exception as e:
+                self.failed += len(batch)
+                logger.error(f"Failed to write {len(batch)} activities: {str(e)}")
+                return
+        if self.on_write:
+            try:
+                self.on_write(batch)
+            except Exception as e:
+                logger.error(f"Activity write callback failed: {str(e)}")
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stop.is_set():
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def flush(self):
+        """Synchronously write everything that is currently queued."""
+        while True:
+            batch = self._drain(self.max_batch)
+            if not batch:
+                return
+            self._write(batch)
+
+    def close(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'flushed': self.flushed,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'batches': self.batches
+        }
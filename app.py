@@ -1,27 +1,43 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, send_file, session, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, jsonify, send_file, session, Response, stream_with_context, copy_current_request_context, g, Request
 from flask_cors import CORS
 import os
-from faster_whisper import WhisperModel
 from werkzeug.utils import secure_filename
-from langchain_groq import ChatGroq
-import edge_tts
-import asyncio
+from werkzeug.exceptions import RequestEntityTooLarge
 import logging
+import queue
+import re
+import threading
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import json
 from dotenv import load_dotenv
 import time
 import uuid
 import base64
-from PIL import Image
 import io
 from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
 from bson import ObjectId
 from datetime import datetime, timedelta
 from functools import wraps
 import jwt
 from werkzeug.security import generate_password_hash, check_password_hash
 from standup_server import socketio, init_app
+from transcription_service import TranscriptionClient, TranscriptionBusy
+from tts_service import TTSService, CachedSpeech, DEFAULT_VOICE
+from tts_cache import AudioCache
+from history_store import ChatHistoryStore
+from prompt_builder import build_prompt, count_tokens, turn_tokens, RollingSummarizer, SYSTEM_PROMPT
+from llm_gateway import LLMGateway, CircuitBreaker, create_backend
+from auth_cache import AuthCache
+from ttl_cache import TTLCache
+from db_indexes import ensure_indexes
+from json_provider import MongoJSONProvider
+from image_ingest import ImageIngestor, ImageIngestBusy
+from image_renditions import RENDITION_SIZES, ensure_rendition
+from blob_store import create_blob_store, OrphanCollector
+from activity_sink import ActivitySink
+from mood_store import MoodStore, PERIODS as MOOD_PERIODS
 
 # Load environment variables
 load_dotenv()
@@ -30,51 +46,80 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)  # Changed from DEBUG to INFO to reduce log spam
 logger = logging.getLogger(__name__)
 
+class AppRequest(Request):
+    """Request whose body size limit a route can lower before reading it.
+
+    Werkzeug enforces max_content_length while it reads the body, so the
+    limit also holds for chunked requests without a Content-Length.
+    """
+
+    body_limit = None
+
+    @property
+    def max_content_length(self):
+        if self.body_limit is not None:
+            return self.body_limit
+        return super().max_content_length
+
 app = Flask(__name__)
+app.request_class = AppRequest
 CORS(app)
 app.secret_key = os.urandom(24)  # Required for session
 
 app.config['SECRET_KEY'] = 'mindmate_secret_key'
 
+# Startup mode:
+#   lazy       - nothing heavy happens at import; models load on first use (default)
+#   background - like lazy, but a warm-up thread starts loading everything right away
+#   eager      - warm up synchronously before serving, failing fast if MongoDB is down
+# In every mode each process creates missing indexes and pre-warms the TTS
+# cache on its first request (see start_process_services).
+STARTUP_MODE = os.getenv('STARTUP_MODE', 'lazy').lower()
+
 # Connect to MongoDB
-try:
-    # Connect to local MongoDB instance (MongoDB Compass)
-    client = MongoClient('mongodb://localhost:27017/', serverSelectionTimeoutMS=5000)
-    db = client['mindmate_db']  # Database name
-    
-    # Collections
-    users = db['users']
-    chat_sessions = db['chat_sessions']
-    diary_entries = db['diary_entries']
-    goals = db['goals']
-    tasks = db['tasks']
-    mood_entries = db['mood_entries']
-    activities = db['activities']  # For general activity tracking
-    
-    # Test the connection
-    client.server_info()
-    print("Connected to MongoDB successfully!")
-except Exception as e:
-    print(f"MongoDB connection error: {str(e)}")
-    raise
-
-# Helper function to convert MongoDB ObjectId to string in JSON responses
-class JSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, ObjectId):
-            return str(obj)
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        return json.JSONEncoder.default(self, obj)
-
-app.json_encoder = JSONEncoder
+# connect=False defers the connection until the first operation, so creating
+# the client and collection handles here does not block startup
+client = MongoClient('mongodb://localhost:27017/', serverSelectionTimeoutMS=5000, connect=False)
+db = client['mindmate_db']  # Database name
+
+# Collections
+users = db['users']
+chat_sessions = db['chat_sessions']
+diary_entries = db['diary_entries']
+goals = db['goals']
+tasks = db['tasks']
+mood_entries = db['mood_entries']
+activities = db['activities']  # For general activity tracking
+mood_rollups = db['mood_rollups']  # Day/week/month mood aggregates
+
+mood_store = MoodStore(mood_entries, mood_rollups)
+
+# Activities are written in the background with insert_many
+activity_sink = ActivitySink(
+    activities,
+    max_batch=int(os.getenv('ACTIVITY_BATCH_SIZE', '100')),
+    flush_interval=float(os.getenv('ACTIVITY_FLUSH_INTERVAL', '1.0')),
+    max_queue=int(os.getenv('ACTIVITY_QUEUE_SIZE', '10000')),
+    # The dashboard shows recent activities, so its cache must not outlive them
+    on_write=lambda batch: invalidate_dashboard(*{a['user_id'] for a in batch if a.get('user_id')})
+)
+
+# Memoized JWT claims and a TTL cache of the user fields handlers need
+auth_cache = AuthCache(
+    users,
+    app.config['SECRET_KEY'],
+    user_ttl=int(os.getenv('AUTH_CACHE_TTL', '60'))
+)
+
+# Encode ObjectId, datetime and other BSON types natively in every JSON response
+app.json = MongoJSONProvider(app)
 
 # Context processor to include navigation data in all templates
 @app.context_processor
 def inject_nav_data():
     def get_user_data():
         if 'user_id' in session:
-            user = users.find_one({'_id': ObjectId(session['user_id'])})
+            user = auth_cache.get_user(session['user_id'])
             if user:
                 return {
                     'name': user.get('name', 'User'),
@@ -102,9 +147,9 @@ def token_required(f):
         
         try:
             # Decode the token
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
+            data = auth_cache.verify_token(token)
             current_user_id = data['user_id']
-            current_user = users.find_one({'_id': ObjectId(current_user_id)})
+            current_user = auth_cache.get_user(current_user_id)
             
             if not current_user:
                 return jsonify({'message': 'User not found!'}), 401
@@ -138,8 +183,12 @@ def register():
             'created_at': datetime.utcnow()
         }
         
-        # Insert user into database
-        result = users.insert_one(new_user)
+        # Insert user into database; the unique email index catches a
+        # concurrent registration that slipped past the check above
+        try:
+            result = users.insert_one(new_user)
+        except DuplicateKeyError:
+            return jsonify({'message': 'User already exists!', 'success': False}), 409
         
         # Create token
         token = jwt.encode({
@@ -148,7 +197,7 @@ def register():
         }, app.config['SECRET_KEY'])
         
         # Log activity
-        activities.insert_one({
+        activity_sink.record({
             'user_id': result.inserted_id,
             'category': 'account',
             'action': 'register',
@@ -187,7 +236,7 @@ def login():
         }, app.config['SECRET_KEY'])
         
         # Log activity
-        activities.insert_one({
+        activity_sink.record({
             'user_id': user['_id'],
             'category': 'account',
             'action': 'login',
@@ -210,15 +259,20 @@ def login():
 
 @app.route('/api/auth/logout', methods=['POST'])
 def logout():
-    session.pop('user_id', None)
+    user_id = session.pop('user_id', None)
+    if user_id:
+        auth_cache.invalidate_user(user_id)
+    auth_header = request.headers.get('Authorization', '')
+    if auth_header.startswith('Bearer '):
+        auth_cache.forget_token(auth_header.split(' ')[1])
     return jsonify({'success': True}), 200
 
 @app.route('/api/auth/verify', methods=['GET'])
 def verify_token():
     try:
         token = request.headers.get('Authorization', '').split(' ')[1]
-        data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        user = users.find_one({'_id': ObjectId(data['user_id'])})
+        data = auth_cache.verify_token(token)
+        user = auth_cache.get_user(data['user_id'])
         
         if user:
             return jsonify({'valid': True, 'user': {'name': user['name'], 'email': user['email']}})
@@ -230,66 +284,138 @@ def verify_token():
 UPLOAD_FOLDER = "uploads"
 OUTPUT_FOLDER = "responses"
 MAX_HISTORY_LENGTH = 5  # Maximum number of conversation pairs to keep
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '1500'))  # Upper bound on input tokens per chat turn
+# Share of the budget for verbatim history; the rest covers the system
+# prompt, the running summary and the user message. Older turns are summarized.
+HISTORY_TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', str(PROMPT_TOKEN_BUDGET * 3 // 5)))
+# Keep uploaded and synthesized audio in memory instead of round-tripping through disk
+AUDIO_IN_MEMORY = os.getenv('AUDIO_IN_MEMORY', 'true').lower() == 'true'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 
 # === Initialize Whisper and Groq ===
-logger.info("Initializing Whisper model...")
-model = WhisperModel("base", device="cpu", compute_type="int8")
-logger.info("Whisper model initialized successfully")
-
-logger.info("Initializing Groq LLM...")
-llm = ChatGroq(
-    temperature=0.6,
-    groq_api_key=os.getenv('GROQ_API_KEY'),
-    model_name="llama-3.3-70b-versatile"
+# Both are created lazily on first use. When a shared transcription service
+# is configured the web workers never load their own copy of the Whisper model.
+TRANSCRIBE_SERVICE_ADDRESS = os.getenv('TRANSCRIBE_SERVICE_ADDRESS')
+if TRANSCRIBE_SERVICE_ADDRESS:
+    logger.info(f"Using transcription service at {TRANSCRIBE_SERVICE_ADDRESS}")
+    transcription_client = TranscriptionClient(TRANSCRIBE_SERVICE_ADDRESS)
+else:
+    transcription_client = None
+
+_model = None
+_init_lock = threading.Lock()
+
+def get_whisper_model():
+    global _model
+    if _model is None:
+        with _init_lock:
+            if _model is None:
+                from faster_whisper import WhisperModel
+
+                logger.info("Initializing Whisper model...")
+                _model = WhisperModel("base", device="cpu", compute_type="int8")
+                logger.info("Whisper model initialized successfully")
+    return _model
+
+# All chat traffic goes through the gateway: deadlines, jittered retries,
+# optional hedging and a circuit breaker around a pluggable backend
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'groq')
+if LLM_BACKEND == 'groq':
+    llm_backend = create_backend(
+        'groq',
+        api_key=os.getenv('GROQ_API_KEY'),
+        max_connections=int(os.getenv('LLM_MAX_CONNECTIONS', '20'))
+    )
+else:
+    llm_backend = create_backend(LLM_BACKEND)
+llm = LLMGateway(
+    llm_backend,
+    max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', '8')),
+    timeout=float(os.getenv('LLM_TIMEOUT', '30')),
+    stream_idle_timeout=float(os.getenv('LLM_STREAM_IDLE_TIMEOUT', '15')),
+    max_retries=int(os.getenv('LLM_MAX_RETRIES', '2')),
+    hedge=os.getenv('LLM_HEDGE', 'false').lower() == 'true',
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.getenv('LLM_BREAKER_THRESHOLD', '5')),
+        reset_timeout=float(os.getenv('LLM_BREAKER_RESET', '30'))
+    )
+)
+
+# Edge-TTS runs on one long-lived event loop shared by all request threads.
+# Synthesized audio is cached by (text, voice, format) under a byte budget.
+tts_cache = AudioCache(
+    os.getenv('TTS_CACHE_DIR', os.path.join(OUTPUT_FOLDER, 'cache')),
+    max_bytes=int(os.getenv('TTS_CACHE_MAX_BYTES', str(256 * 1024 * 1024))),
+    # Workers share the directory; rescan it this often to enforce the budget
+    sync_interval=float(os.getenv('TTS_CACHE_SYNC_INTERVAL', '10'))
+)
+tts = TTSService(
+    max_concurrent=int(os.getenv('TTS_MAX_CONCURRENT', '4')),
+    timeout=float(os.getenv('TTS_TIMEOUT', '60')),
+    cache=tts_cache
 )
-logger.info("Groq LLM initialized successfully")
 
 # === Conversation History Management ===
+# History is kept server-side in chat_sessions; the cookie only carries the id
+history_store = ChatHistoryStore(
+    chat_sessions,
+    max_length=MAX_HISTORY_LENGTH,
+    cache_ttl=int(os.getenv('HISTORY_CACHE_TTL', '30')),
+    max_tokens=HISTORY_TOKEN_BUDGET,
+    turn_tokens=turn_tokens
+)
+
+summarizer = RollingSummarizer(
+    history_store,
+    llm.invoke,
+    max_queue=int(os.getenv('SUMMARY_QUEUE_SIZE', '256'))
+)
+
+def get_chat_session_id():
+    # Must be called before a streamed response starts, since the session
+    # cookie is written together with the response headers
+    if 'chat_session_id' not in session:
+        session['chat_session_id'] = uuid.uuid4().hex
+        # Drop history left in the cookie by older versions
+        session.pop('conversation_history', None)
+    return session['chat_session_id']
+
 def get_conversation_history():
-    if 'conversation_history' not in session:
-        session['conversation_history'] = []
-    return session['conversation_history']
+    return history_store.get(get_chat_session_id())
 
 def add_to_history(user_input, ai_response):
-    history = get_conversation_history()
-    history.append({
-        'user': user_input,
-        'ai': ai_response
-    })
-    # Keep only the last MAX_HISTORY_LENGTH conversations
-    if len(history) > MAX_HISTORY_LENGTH:
-        history = history[-MAX_HISTORY_LENGTH:]
-    session['conversation_history'] = history
-
-def format_conversation_history():
-    history = get_conversation_history()
-    formatted_history = ""
-    for entry in history:
-        formatted_history += f"User: {entry['user']}\nAI: {entry['ai']}\n\n"
-    return formatted_history
+    # The store keeps only the last MAX_HISTORY_LENGTH conversations that
+    # fit in HISTORY_TOKEN_BUDGET; older ones are folded into the running
+    # summary in the background
+    session_id = get_chat_session_id()
+    evicted = history_store.append(session_id, user_input, ai_response)
+    summarizer.submit(session_id, evicted)
 
 # === Helper: AI Response ===
+FALLBACK_RESPONSE = "I'm sorry, I'm having some trouble connecting to my thinking capabilities right now. Could you please try again in a moment?"
+
+def build_chat_prompt(user_input):
+    session_id = get_chat_session_id()
+    prompt, prompt_tokens = build_prompt(
+        user_input,
+        history_store.get(session_id),
+        summary=history_store.get_summary(session_id),
+        token_budget=PROMPT_TOKEN_BUDGET
+    )
+    # Reported back to the client and in the logs for every chat turn
+    g.prompt_tokens = prompt_tokens
+    logger.info(f"Prompt size: {prompt_tokens} tokens")
+    return prompt
+
 def get_ai_response(transcription):
     logger.debug(f"Getting AI response for transcription: {transcription[:100]}...")
     
-    # Get conversation history
-    conversation_history = format_conversation_history()
-    
-    prompt = (
-        f"Previous conversation:\n{conversation_history}\n"
-        f"Current user message: {transcription}\n\n"
-        "You are a highly experienced, warm, and friendly AI Psychiatrist. "
-        "Please answer the user with empathy and offer supportive guidance based on their concerns. "
-        "Please provide the answer not too long and not too short like it should be like a conversation. "
-        "Please provide the answer in a way that is easy to understand and not too technical, not too formal and not too informal."
-    )
+    prompt = build_chat_prompt(transcription)
     
     try:
-        response = llm.invoke(prompt)
-        ai_response = response.content if hasattr(response, 'content') else str(response)
+        ai_response = llm.invoke(prompt)
         logger.debug(f"Successfully received AI response: {ai_response[:100]}...")
         
         # Add to conversation history
@@ -299,28 +425,17 @@ def get_ai_response(transcription):
     except Exception as e:
         logger.error(f"Error getting AI response: {str(e)}")
         # Return a fallback response
-        fallback_response = "I'm sorry, I'm having some trouble connecting to my thinking capabilities right now. Could you please try again in a moment?"
+        fallback_response = FALLBACK_RESPONSE
         return fallback_response
 
 def get_ai_text_response(user_input):
     logger.debug(f"Getting AI response for text input: {user_input[:100]}...")
     
-    # Get conversation history
-    conversation_history = format_conversation_history()
-    
-    prompt = (
-        f"Previous conversation:\n{conversation_history}\n"
-        f"Current user message: {user_input}\n\n"
-        "You are a highly experienced, warm, and friendly AI Psychiatrist. "
-        "Please answer the user with empathy and offer supportive guidance based on their concerns. "
-        "Please provide the answer not too long and not too short like it should be like a conversation. "
-        "Please provide the answer in a way that is easy to understand and not too technical, not too formal and not too informal."
-    )
+    prompt = build_chat_prompt(user_input)
     
     try:
         # Use the same LLM as voice chat to avoid API key issues
-        response = llm.invoke(prompt)
-        ai_response = response.content if hasattr(response, 'content') else str(response)
+        ai_response = llm.invoke(prompt)
         logger.debug(f"Successfully received AI response: {ai_response[:100]}...")
         
         # Add to conversation history
@@ -330,31 +445,291 @@ def get_ai_text_response(user_input):
     except Exception as e:
         logger.error(f"Error getting AI response: {str(e)}")
         # Return a fallback response
-        fallback_response = "I'm sorry, I'm having some trouble connecting to my thinking capabilities right now. Could you please try again in a moment?"
+        fallback_response = FALLBACK_RESPONSE
         # Still add to history so the UI flow is maintained
         add_to_history(user_input, fallback_response)
         return fallback_response
 
-# === Helper: Text to Speech with Edge-TTS ===
-async def edge_tts_async(text, output_path, voice="en-US-JennyNeural"):
-    logger.debug(f"Converting text to speech: {text[:100]}...")
+def stream_ai_text_response(user_input):
+    """Yield the AI reply chunk by chunk as the LLM produces it.
+
+    The full reply is added to the conversation history once the stream
+    finishes. If the consumer stops early (client disconnect) the upstream
+    stream is closed and nothing is recorded. If the LLM fails after part
+    of the reply was sent, g.reply_incomplete is set and the partial reply
+    is not recorded either.
+    """
+    logger.debug(f"Streaming AI response for text input: {user_input[:100]}...")
+    
+    prompt = build_chat_prompt(user_input)
+    
+    chunks = []
+    upstream = None
     try:
-        communicate = edge_tts.Communicate(text, voice=voice)
-        await communicate.save(output_path)
-        logger.debug(f"Successfully saved audio to {output_path}")
-    except Exception as e:
-        logger.error(f"Error in text-to-speech conversion: {str(e)}")
+        upstream = llm.stream(prompt)
+        for token in upstream:
+            if token:
+                chunks.append(token)
+                yield token
+    except GeneratorExit:
+        logger.info("Client disconnected while streaming AI response")
         raise
+    except Exception as e:
+        logger.error(f"Error streaming AI response: {str(e)}")
+        if chunks:
+            g.reply_incomplete = True
+            return
+        chunks.append(FALLBACK_RESPONSE)
+        yield FALLBACK_RESPONSE
+    finally:
+        if upstream is not None and hasattr(upstream, 'close'):
+            upstream.close()
+    
+    add_to_history(user_input, "".join(chunks))
 
-def text_to_speech(text, output_path="responses/response.mp3"):
+def sse_event(data, event=None):
+    # Format a single Server-Sent Events message
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+# === Helper: Text to Speech with Edge-TTS ===
+def text_to_speech(text, voice=DEFAULT_VOICE):
+    """Synthesize text into the audio cache and return the MP3 path."""
     logger.debug("Starting text-to-speech conversion")
     try:
-        asyncio.run(edge_tts_async(text, output_path))
-        return output_path
+        return tts.synthesize_to_cache(text, voice)
     except Exception as e:
         logger.error(f"Error in text_to_speech: {str(e)}")
         raise
 
+def audio_response(chunks):
+    return Response(
+        stream_with_context(chunks),
+        mimetype='audio/mpeg',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def speech_response(text, voice=DEFAULT_VOICE):
+    if not AUDIO_IN_MEMORY:
+        return send_file(text_to_speech(text, voice), mimetype='audio/mpeg')
+    
+    speech = tts.stream(text, voice)
+    if isinstance(speech, CachedSpeech):
+        # Cache hits are served straight from disk
+        logger.debug("Serving speech from TTS cache")
+        return send_file(speech.path, mimetype='audio/mpeg')
+    # Stream edge-tts chunks as they arrive, without touching disk
+    return audio_response(iter(speech))
+
+# === Helper: Speech to Text ===
+def transcribe_audio(audio):
+    logger.debug("Starting audio transcription")
+    if transcription_client:
+        transcription = transcription_client.transcribe(audio)
+    else:
+        segments, _ = get_whisper_model().transcribe(audio)
+        transcription = " ".join([segment.text for segment in segments])
+    logger.debug(f"Transcription completed: {transcription[:100]}...")
+    return transcription
+
+def save_uploaded_audio(file):
+    """Return (audio, temp_path) for an uploaded recording.
+
+    In memory mode the upload is handed to Whisper as a buffer and no file
+    is written. Otherwise it is saved under a unique name so concurrent
+    uploads with the same client filename cannot overwrite each other.
+    """
+    if AUDIO_IN_MEMORY:
+        return io.BytesIO(file.read()), None
+    filename = f"{uuid.uuid4().hex}_{secure_filename(file.filename)}"
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    logger.debug(f"Saving uploaded file to {filepath}")
+    file.save(filepath)
+    return filepath, filepath
+
+# === Helper: Pipelined voice reply ===
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+MIN_SENTENCE_LENGTH = 20  # Avoid synthesizing tiny fragments like "Hi."
+# Syntheses in flight per voice reply: the sentence playing and the next one
+VOICE_LOOKAHEAD_SENTENCES = int(os.getenv('VOICE_LOOKAHEAD_SENTENCES', '2'))
+_PIPELINE_DONE = object()
+def split_sentences(tokens):
+    """Regroup a stream of LLM tokens into sentences.
+
+    Short sentences are merged with the following one so that each TTS call
+    has enough text to sound natural.
+    """
+    buffer = ""
+    for token in tokens:
+        buffer += token
+        parts = SENTENCE_BOUNDARY.split(buffer)
+        if len(parts) == 1:
+            continue
+        pending = ""
+        for part in parts[:-1]:
+            pending = f"{pending} {part}".strip()
+            if len(pending) >= MIN_SENTENCE_LENGTH:
+                yield pending
+                pending = ""
+        buffer = f"{pending} {parts[-1]}" if pending else parts[-1]
+    if buffer.strip():
+        yield buffer.strip()
+
+def stream_voice_reply(transcription, voice=DEFAULT_VOICE):
+    """Yield MP3 bytes for the AI reply while the reply is still generating.
+
+    The LLM stream is split into sentences on a worker thread and each
+    sentence is submitted to the TTS service as soon as it is complete, so
+    the first audio frames are ready after roughly one sentence of work.
+    Audio is yielded strictly in sentence order. At most
+    VOICE_LOOKAHEAD_SENTENCES syntheses per reply are in flight (the one
+    playing included), so one long reply cannot take every TTS slot from
+    other users' first sentences.
+    """
+    speech_streams = queue.Queue()
+    lookahead = threading.Semaphore(VOICE_LOOKAHEAD_SENTENCES)
+    cancelled = threading.Event()
+
+    @copy_current_request_context
+    def generate_sentences():
+        tokens = stream_ai_text_response(transcription)
+        try:
+            for sentence in split_sentences(tokens):
+                # Wait until the sentence being played leaves room
+                while not lookahead.acquire(timeout=0.5):
+                    if cancelled.is_set():
+                        break
+                if cancelled.is_set():
+                    break
+                logger.debug(f"Queueing sentence for speech: {sentence[:100]}...")
+                speech_streams.put(tts.stream(sentence, voice))
+        except Exception as e:
+            logger.error(f"Error generating reply sentences: {str(e)}")
+        finally:
+            tokens.close()
+            speech_streams.put(_PIPELINE_DONE)
+
+    threading.Thread(target=generate_sentences, daemon=True).start()
+
+    try:
+        while True:
+            speech = speech_streams.get()
+            if speech is _PIPELINE_DONE:
+                break
+            yield from speech
+            lookahead.release()
+    finally:
+        cancelled.set()
+        # Cancel syntheses that were started but never consumed
+        while True:
+            try:
+                speech = speech_streams.get_nowait()
+            except queue.Empty:
+                break
+            if speech is not _PIPELINE_DONE:
+                speech.cancel()
+
+# === Warm-up and readiness ===
+warmup_state = {'status': 'idle', 'started_at': None, 'finished_at': None, 'error': None}
+_warmup_lock = threading.Lock()
+
+def warm_up():
+    """Connect to MongoDB and load every lazily initialized component."""
+    with _warmup_lock:
+        if warmup_state['status'] == 'done':
+            return
+        warmup_state.update(status='running', started_at=time.time(), error=None)
+        try:
+            client.admin.command('ping')
+            logger.info("Connected to MongoDB successfully!")
+            ensure_indexes(db)
+            if not transcription_client:
+                get_whisper_model()
+            llm.backend.load()
+            warmup_state.update(status='done', finished_at=time.time())
+        except Exception as e:
+            logger.error(f"Warm-up failed: {str(e)}")
+            warmup_state.update(status='failed', finished_at=time.time(), error=str(e))
+            raise
+
+# === Per-process background services ===
+_services_pid = None
+_services_lock = threading.Lock()
+
+def prepare_resources():
+    # Cheap and idempotent, so every process runs it whatever STARTUP_MODE is
+    try:
+        ensure_indexes(db)
+    except Exception as e:
+        logger.error(f"Could not ensure MongoDB indexes: {str(e)}")
+    # Load the tokenizer here rather than on the first chat turn
+    count_tokens(SYSTEM_PROMPT)
+    # Pre-warm the canned fallback reply, both whole and as the
+    # sentences the pipelined voice reply splits it into
+    tts.prewarm([FALLBACK_RESPONSE] + list(split_sentences([FALLBACK_RESPONSE])))
+
+def start_process_services():
+    """Start this process's background work once.
+
+    Runs on the first request instead of at import, so importing the app
+    stays cheap and no thread is started before a `gunicorn --preload`
+    fork (threads do not survive into the forked workers).
+    """
+    global _services_pid
+    if _services_pid == os.getpid():
+        return
+    with _services_lock:
+        if _services_pid == os.getpid():
+            return
+        _services_pid = os.getpid()
+        if BLOB_GC_ENABLED:
+            blob_gc.start()
+        threading.Thread(target=prepare_resources, name='prepare-resources', daemon=True).start()
+
+@app.before_request
+def ensure_process_services():
+    start_process_services()
+
+def start_background_warm_up():
+    def run():
+        try:
+            warm_up()
+        except Exception:
+            pass  # Already logged and recorded in warmup_state
+
+    threading.Thread(target=run, name='warm-up', daemon=True).start()
+
+@app.route('/warmup', methods=['POST'])
+def warmup():
+    try:
+        warm_up()
+    except Exception as e:
+        return jsonify({'status': 'failed', 'error': str(e)}), 503
+    return jsonify({'status': warmup_state['status']}), 200
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Liveness: the process is up and serving requests
+    return jsonify({'status': 'ok'}), 200
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    # Readiness: MongoDB is reachable. Models load on demand, so they are
+    # reported but do not block readiness.
+    components = {
+        'whisper': 'remote' if transcription_client else ('loaded' if _model is not None else 'lazy'),
+        'llm': llm.stats() if llm.backend.loaded else 'lazy',
+        'warmup': warmup_state['status'],
+        'activity_sink': activity_sink.stats()
+    }
+    try:
+        client.admin.command('ping')
+        components['mongodb'] = 'ok'
+    except Exception as e:
+        components['mongodb'] = f'error: {str(e)}'
+        return jsonify({'ready': False, 'components': components}), 503
+    return jsonify({'ready': True, 'components': components}), 200
+
 @app.route('/voice_chat', methods=['POST'])
 def voice_chat():
     logger.info("Received voice chat request")
@@ -368,19 +743,13 @@ def voice_chat():
         logger.error("Empty filename received")
         return jsonify({'error': 'Empty filename'}), 400
 
-    filename = secure_filename(file.filename)
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    filepath = None
     
     try:
-        logger.debug(f"Saving uploaded file to {filepath}")
-        file.save(filepath)
-        logger.debug("File saved successfully")
+        audio, filepath = save_uploaded_audio(file)
 
         # Transcribe the audio
-        logger.debug("Starting audio transcription")
-        segments, _ = model.transcribe(filepath)
-        transcription = " ".join([segment.text for segment in segments])
-        logger.debug(f"Transcription completed: {transcription[:100]}...")
+        transcription = transcribe_audio(audio)
 
         # Get AI response
         logger.debug("Getting AI response")
@@ -389,26 +758,57 @@ def voice_chat():
         
         # Add to conversation history (already handled in get_ai_response)
 
-        # Convert AI response to speech
-        output_filename = f"response_{os.path.splitext(filename)[0]}.mp3"
-        output_path = os.path.join(OUTPUT_FOLDER, output_filename)
-        logger.debug(f"Converting response to speech, output path: {output_path}")
-        text_to_speech(ai_response, output_path)
-        logger.debug("Speech conversion completed")
+        # Convert AI response to speech and return the MP3 audio
+        logger.info("Sending response audio to client")
+        return speech_response(ai_response)
 
-        # Return the MP3 audio file directly
-        logger.info("Sending response file to client")
-        return send_file(output_path, mimetype='audio/mpeg')
+    except TranscriptionBusy as e:
+        logger.warning(f"Transcription service busy: {str(e)}")
+        return jsonify({'error': 'Voice service is busy, please try again shortly'}), 503
 
     except Exception as e:
         logger.error(f"Error processing voice chat request: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
     finally:
-        if os.path.exists(filepath):
+        if filepath and os.path.exists(filepath):
             logger.debug(f"Cleaning up temporary file: {filepath}")
             os.remove(filepath)
 
+@app.route('/voice_chat/stream', methods=['POST'])
+def voice_chat_stream():
+    logger.info("Received streaming voice chat request")
+    
+    if 'audio' not in request.files:
+        logger.error("No audio file in request")
+        return jsonify({'error': 'No audio file uploaded'}), 400
+
+    file = request.files['audio']
+    if file.filename == '':
+        logger.error("Empty filename received")
+        return jsonify({'error': 'Empty filename'}), 400
+
+    filepath = None
+    
+    try:
+        audio, filepath = save_uploaded_audio(file)
+        transcription = transcribe_audio(audio)
+    except TranscriptionBusy as e:
+        logger.warning(f"Transcription service busy: {str(e)}")
+        return jsonify({'error': 'Voice service is busy, please try again shortly'}), 503
+    except Exception as e:
+        logger.error(f"Error transcribing voice chat request: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if filepath and os.path.exists(filepath):
+            os.remove(filepath)
+
+    # Audio is sent with chunked transfer encoding as soon as each sentence
+    # has been synthesized
+    get_chat_session_id()
+    logger.info("Streaming pipelined voice response to client")
+    return audio_response(stream_voice_reply(transcription))
+
 @app.route('/')
 def index():
     logger.info("Serving index page")
@@ -423,8 +823,9 @@ def games():
 @app.route('/clear_history', methods=['POST'])
 def clear_history():
     logger.info("Clearing conversation history")
-    if 'conversation_history' in session:
-        session['conversation_history'] = []
+    session_id = get_chat_session_id()
+    summarizer.forget(session_id)
+    history_store.clear(session_id)
     return jsonify({'status': 'success'}), 200
 
 @app.route('/get_history', methods=['GET'])
@@ -452,13 +853,42 @@ def text_chat():
         
         # Return the response as JSON
         return jsonify({
-            'response': ai_response
+            'response': ai_response,
+            'prompt_tokens': g.get('prompt_tokens')
         })
         
     except Exception as e:
         logger.error(f"Error processing text chat request: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/text_chat/stream', methods=['POST'])
+def text_chat_stream():
+    logger.info("Received streaming text chat request")
+    data = request.get_json(silent=True) or {}
+    user_input = data.get('user_input')
+    if not user_input:
+        logger.error("No user input provided")
+        return jsonify({'error': 'No user input provided'}), 400
+    
+    def generate():
+        reply = []
+        for token in stream_ai_text_response(user_input):
+            reply.append(token)
+            yield sse_event({'token': token})
+        yield sse_event({
+            'response': "".join(reply),
+            'complete': not g.get('reply_incomplete', False),
+            'prompt_tokens': g.get('prompt_tokens')
+        }, event='done')
+    
+    # Assign the chat session id before the headers (and cookie) go out
+    get_chat_session_id()
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/text_to_speech', methods=['POST'])
 def text_to_speech_route():
     logger.info("Received text-to-speech request")
@@ -471,126 +901,229 @@ def text_to_speech_route():
             
         logger.debug(f"Converting text to speech: {text[:100]}...")
         
-        # Generate a unique filename
-        output_filename = f"response_{int(time.time())}.mp3"
-        output_path = os.path.join(OUTPUT_FOLDER, output_filename)
-        
-        # Convert text to speech
-        text_to_speech(text, output_path)
-        
-        # Return the speech file
-        return send_file(output_path, mimetype='audio/mpeg')
+        # Return the speech audio
+        return speech_response(text)
         
     except Exception as e:
         logger.error(f"Error processing text-to-speech request: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/text_to_speech/cache', methods=['GET'])
+def text_to_speech_cache_stats():
+    return jsonify(tts_cache.stats()), 200
+
 # Create uploads directory if it doesn't exist
 UPLOADS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads')
 os.makedirs(UPLOADS_DIR, exist_ok=True)
 
-@app.route('/api/diary/create-entry', methods=['POST'])
-@token_required
-def create_diary_entry(current_user):
-    data = request.get_json()
-    
+MAX_ENTRY_UPLOAD_BYTES = int(os.getenv('MAX_ENTRY_UPLOAD_BYTES', str(50 * 1024 * 1024)))
+# Diary images live in a content-addressed blob store; the local backend
+# keeps them in sharded subdirectories of UPLOADS_DIR
+blob_store = create_blob_store(os.getenv('BLOB_STORE_BACKEND', 'local'), root=UPLOADS_DIR)
+blob_gc = OrphanCollector(
+    blob_store,
+    diary_entries,
+    interval=int(os.getenv('BLOB_GC_INTERVAL', '3600')),
+    grace_seconds=int(os.getenv('BLOB_GC_GRACE', '3600')),
+    # Every process runs the loop; the lease lets one of them collect per interval
+    leases=db['leases']
+)
+# Started per process by start_process_services
+BLOB_GC_ENABLED = os.getenv('BLOB_GC_ENABLED', 'true').lower() == 'true'
+
+image_ingestor = ImageIngestor(
+    blob_store,
+    max_image_bytes=int(os.getenv('MAX_IMAGE_BYTES', str(10 * 1024 * 1024))),
+    max_workers=int(os.getenv('IMAGE_WORKERS', '2')),
+    max_pending=int(os.getenv('IMAGE_MAX_PENDING', '16'))
+)
+
+def insert_diary_entry(current_user, title, content, mood, tags, images, details):
+    # Create the diary entry
+    entry_date = datetime.utcnow()
     new_entry = {
         'user_id': current_user['_id'],
-        'title': data['title'],
-        'content': data['content'],
-        'mood': data.get('mood'),  # Optional mood rating
-        'tags': data.get('tags', []),  # Optional tags
-        'created_at': datetime.utcnow(),
-        'updated_at': datetime.utcnow(),
-        'images': [],  # Initialize empty images array
-        'year': datetime.utcnow().year  # Add year for filtering by year
+        'title': title,
+        'content': content,
+        'mood': mood,  # Optional mood rating
+        'tags': tags,  # Optional tags
+        'created_at': entry_date,
+        'updated_at': entry_date,
+        'images': images,  # Store image references
+        'year': entry_date.year  # Add year for filtering by year
     }
     
     result = diary_entries.insert_one(new_entry)
     
     # Log activity
-    activities.insert_one({
+    activity_sink.record({
         'user_id': current_user['_id'],
         'category': 'diary',
         'action': 'create_entry',
-        'timestamp': datetime.utcnow(),
-        'details': f"Created diary entry: {data['title']}",
+        'timestamp': entry_date,
+        'details': details,
         'reference_id': result.inserted_id
     })
     
-    return jsonify({'entry_id': str(result.inserted_id)}), 201
+    invalidate_dashboard(current_user['_id'])
+    
+    # Diary moods count towards the mood trends too
+    if mood:
+        try:
+            mood_store.record(current_user['_id'], mood, source='diary', recorded_at=entry_date)
+        except ValueError:
+            logger.debug(f"Diary mood {mood!r} has no score, not added to mood trends")
+    
+    return result.inserted_id
+
+@app.route('/api/diary/create-entry', methods=['POST'])
+@token_required
+def create_diary_entry(current_user):
+    data = request.get_json()
+    
+    entry_id = insert_diary_entry(
+        current_user, data['title'], data['content'], data.get('mood'), data.get('tags', []),
+        [], f"Created diary entry: {data['title']}"
+    )
+    
+    return jsonify({'entry_id': str(entry_id)}), 201
 
 @app.route('/api/diary/create-entry-with-images', methods=['POST'])
 @token_required
 def create_diary_entry_with_images(current_user):
     data = request.get_json()
     
-    # Process images if any
-    images = []
+    # Decode the base64 data URLs; verification and re-encoding happen on
+    # the image worker pool
+    uploads = []
     if 'images' in data and data['images']:
         for img in data['images']:
             # Extract base64 data from the data URL
             if 'data' in img and img['data'].startswith('data:image/'):
                 # Format: data:image/jpeg;base64,/9j/4AAQSkZJRgABAQEASA...
                 # Extract only the base64 part
-                img_format = img['data'].split(';')[0].split('/')[-1]
                 img_data = img['data'].split(',', 1)[1]
-                
-                # Generate a unique filename
-                filename = f"{secure_filename(str(uuid.uuid4()))}.{img_format}"
-                filepath = os.path.join(UPLOADS_DIR, filename)
-                
                 try:
-                    # Decode and save image
-                    img_bytes = base64.b64decode(img_data)
-                    img_io = io.BytesIO(img_bytes)
-                    img_pil = Image.open(img_io)
-                    img_pil.save(filepath)
-                    
-                    # Add to images array
-                    images.append({
-                        'filename': filename,
-                        'original_name': img.get('filename', 'unknown')
-                    })
+                    uploads.append((io.BytesIO(base64.b64decode(img_data)), img.get('filename', 'unknown')))
                 except Exception as e:
-                    print(f"Error saving image: {str(e)}")
+                    logger.error(f"Error decoding image: {str(e)}")
     
-    # Create the diary entry
-    entry_date = datetime.utcnow()
-    new_entry = {
-        'user_id': current_user['_id'],
-        'title': data['title'],
-        'content': data['content'],
-        'mood': data.get('mood'),  # Optional mood rating
-        'tags': data.get('tags', []),  # Optional tags
-        'created_at': entry_date,
-        'updated_at': entry_date,
-        'images': images,  # Store image references
-        'year': entry_date.year  # Add year for filtering by year
-    }
+    try:
+        images = image_ingestor.ingest(uploads)
+    except ImageIngestBusy as e:
+        return jsonify({'error': str(e)}), 503
     
-    result = diary_entries.insert_one(new_entry)
+    entry_id = insert_diary_entry(
+        current_user, data['title'], data['content'], data.get('mood'), data.get('tags', []),
+        images, f"Created diary entry with images: {data['title']}"
+    )
     
-    # Log activity
-    activities.insert_one({
-        'user_id': current_user['_id'],
-        'category': 'diary',
-        'action': 'create_entry',
-        'timestamp': entry_date,
-        'details': f"Created diary entry with images: {data['title']}",
-        'reference_id': result.inserted_id
-    })
+    return jsonify({'entry_id': str(entry_id), 'images': images}), 201
+
+@app.route('/api/diary/create-entry-multipart', methods=['POST'])
+@token_required
+def create_diary_entry_multipart(current_user):
+    # Multipart upload: images arrive as raw file parts, which Werkzeug
+    # spools to temporary files instead of holding them in memory
+    if request.content_length and request.content_length > MAX_ENTRY_UPLOAD_BYTES:
+        return jsonify({'error': 'Upload is too large'}), 413
+    # Chunked uploads have no Content-Length; cap them while parsing
+    request.body_limit = MAX_ENTRY_UPLOAD_BYTES
+    try:
+        form = request.form
+    except RequestEntityTooLarge:
+        return jsonify({'error': 'Upload is too large'}), 413
+    
+    title = form.get('title')
+    content = form.get('content')
+    if not title or content is None:
+        return jsonify({'error': 'title and content are required'}), 400
+    
+    uploads = [(file.stream, file.filename or 'unknown')
+               for file in request.files.getlist('images') if file]
+    try:
+        images = image_ingestor.ingest(uploads)
+    except ImageIngestBusy as e:
+        return jsonify({'error': str(e)}), 503
+    
+    tags = [tag.strip() for tag in request.form.getlist('tags') if tag.strip()]
+    entry_id = insert_diary_entry(
+        current_user, title, content, request.form.get('mood'), tags,
+        images, f"Created diary entry with images: {title}"
+    )
     
-    return jsonify({'entry_id': str(result.inserted_id), 'images': images}), 201
+    return jsonify({'entry_id': str(entry_id), 'images': images}), 201
+
+# === Diary listing helpers ===
+DIARY_PAGE_SIZE = 20
+DIARY_MAX_PAGE_SIZE = 100
+# Enough to render a list item: title, mood, date and the first image
+DIARY_SUMMARY_PROJECTION = {'title': 1, 'mood': 1, 'created_at': 1, 'images': {'$slice': 1}}
+
+def encode_cursor(entry, field='created_at'):
+    position = {'t': entry[field].isoformat(), 'id': str(entry['_id'])}
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+def decode_cursor(cursor):
+    # Raises ValueError for malformed cursors
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(position['t']), ObjectId(position['id'])
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {str(e)}")
+
+def list_diary_entries(query, default_view='summary', extra=None):
+    """Return a page of diary entries matching query, newest first.
+
+    Query parameters:
+      limit  - page size (default DIARY_PAGE_SIZE, at most DIARY_MAX_PAGE_SIZE)
+      cursor - next_cursor from the previous page
+      view   - 'summary' (title, mood, date, first image) or 'full'
+      format - 'ndjson' streams every matching entry, one JSON document per line
+
+    Pages are keyset-paginated on (created_at, _id), so the cost of a page
+    does not depend on how far into the history it is.
+    """
+    view = request.args.get('view', default_view)
+    if view not in ('summary', 'full'):
+        return jsonify({'error': "view must be 'summary' or 'full'"}), 400
+    projection = DIARY_SUMMARY_PROJECTION if view == 'summary' else None
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            created_at, entry_id = decode_cursor(cursor)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        query = dict(query, **{'$or': [
+            {'created_at': {'$lt': created_at}},
+            {'created_at': created_at, '_id': {'$lt': entry_id}}
+        ]})
+
+    sort = [('created_at', -1), ('_id', -1)]
+
+    if request.args.get('format') == 'ndjson':
+        def generate():
+            for entry in diary_entries.find(query, projection).sort(sort).batch_size(DIARY_PAGE_SIZE):
+                yield app.json.dumps(entry) + "\n"
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    try:
+        limit = min(int(request.args.get('limit', DIARY_PAGE_SIZE)), DIARY_MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'limit must be a positive number'}), 400
+
+    # Fetch one extra entry to know whether another page exists
+    entries = list(diary_entries.find(query, projection).sort(sort).limit(limit + 1))
+    next_cursor = encode_cursor(entries[limit - 1]) if len(entries) > limit else None
+    return jsonify(dict(extra or {}, entries=entries[:limit], next_cursor=next_cursor)), 200
 
 @app.route('/api/diary/get-entries', methods=['GET'])
 @token_required
 def get_diary_entries(current_user):
-    entries = list(diary_entries.find(
-        {'user_id': current_user['_id']}
-    ).sort('created_at', -1))
-    
-    return jsonify({'entries': entries}), 200
+    return list_diary_entries({'user_id': current_user['_id']})
 
 @app.route('/api/diary/get-entries-by-year', methods=['GET'])
 @token_required
@@ -605,24 +1138,91 @@ def get_entries_by_year(current_user):
     except ValueError:
         return jsonify({'error': 'Year must be a valid number'}), 400
     
-    # Find entries for the specified year
-    entries = list(diary_entries.find(
-        {
-            'user_id': current_user['_id'],
-            'year': year_int
-        }
-    ).sort('created_at', -1))
+    # Find entries for the specified year. The diary page renders entries
+    # directly, so full documents stay the default here.
+    return list_diary_entries(
+        {'user_id': current_user['_id'], 'year': year_int},
+        default_view='full',
+        extra={'year': year}
+    )
+
+@app.route('/api/diary/get-entry/<entry_id>', methods=['GET'])
+@token_required
+def get_diary_entry(current_user, entry_id):
+    # Full content for an entry listed with the summary view
+    try:
+        entry_oid = ObjectId(entry_id)
+    except Exception:
+        return jsonify({'error': 'Invalid entry id'}), 400
     
-    # Convert ObjectId to string for JSON serialization
-    for entry in entries:
-        entry['_id'] = str(entry['_id'])
-        entry['user_id'] = str(entry['user_id'])
-        if 'created_at' in entry:
-            entry['created_at'] = entry['created_at'].isoformat()
-        if 'updated_at' in entry:
-            entry['updated_at'] = entry['updated_at'].isoformat()
+    entry = diary_entries.find_one({'_id': entry_oid, 'user_id': current_user['_id']})
+    if not entry:
+        return jsonify({'error': 'Entry not found'}), 404
     
-    return jsonify({'entries': entries, 'year': year}), 200
+    return jsonify({'entry': entry}), 200
+
+def parse_date_range(field):
+    """Build a filter on field from the from_date/to_date query parameters.
+
+    Dates are YYYY-MM-DD and both ends are inclusive. Returns an empty dict
+    when neither is given and raises ValueError for malformed dates.
+    """
+    bounds = {}
+    from_date = request.args.get('from_date')
+    to_date = request.args.get('to_date')
+    if from_date:
+        bounds['$gte'] = datetime.combine(datetime.fromisoformat(from_date).date(), datetime.min.time())
+    if to_date:
+        bounds['$lte'] = datetime.combine(datetime.fromisoformat(to_date).date(), datetime.max.time())
+    return {field: bounds} if bounds else {}
+
+@app.route('/api/diary/search', methods=['GET'])
+@token_required
+def search_diary_entries(current_user):
+    """Search entries by text (q), tags and date range.
+
+    Text searches use the diary text index and are ranked by relevance,
+    paginated with page/limit. Without q the results are the filtered
+    entries newest first, keyset-paginated like get-entries.
+    """
+    query = {'user_id': current_user['_id']}
+    
+    tags = [tag.strip() for tag in request.args.get('tags', '').split(',') if tag.strip()]
+    if tags:
+        query['tags'] = {'$all': tags}
+    
+    try:
+        query.update(parse_date_range('created_at'))
+    except ValueError:
+        return jsonify({'error': 'Invalid date format, use YYYY-MM-DD'}), 400
+    
+    text = request.args.get('q', '').strip()
+    if not text:
+        return list_diary_entries(query)
+    
+    try:
+        limit = min(int(request.args.get('limit', DIARY_PAGE_SIZE)), DIARY_MAX_PAGE_SIZE)
+        page = int(request.args.get('page', 1))
+        if limit < 1 or page < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'limit and page must be positive numbers'}), 400
+    
+    query['$text'] = {'$search': text}
+    projection = dict(DIARY_SUMMARY_PROJECTION, score={'$meta': 'textScore'})
+    # Fetch one extra entry to know whether another page exists
+    entries = list(
+        diary_entries.find(query, projection)
+        .sort([('score', {'$meta': 'textScore'}), ('created_at', -1)])
+        .skip((page - 1) * limit)
+        .limit(limit + 1)
+    )
+    
+    return jsonify({
+        'entries': entries[:limit],
+        'page': page,
+        'next_page': page + 1 if len(entries) > limit else None
+    }), 200
 
 @app.route('/api/diary/get-entry-by-date', methods=['GET'])
 @token_required
@@ -650,20 +1250,349 @@ def get_entry_by_date(current_user):
     if not entry:
         return jsonify({'error': 'No entry found for the specified date'}), 404
     
-    # Convert ObjectId to string for JSON serialization
-    entry['_id'] = str(entry['_id'])
-    entry['user_id'] = str(entry['user_id'])
-    if 'created_at' in entry:
-        entry['created_at'] = entry['created_at'].isoformat()
-    if 'updated_at' in entry:
-        entry['updated_at'] = entry['updated_at'].isoformat()
-    
     return jsonify({'entry': entry}), 200
 
+# === Dashboard ===
+# Summaries are cached per user for a short time, tagged with the user's
+# dashboard_version. Every write that changes the dashboard bumps that
+# version in MongoDB, so cached summaries in every worker go stale at once.
+DASHBOARD_CACHE_TTL = int(os.getenv('DASHBOARD_CACHE_TTL', '30'))
+DASHBOARD_RECENT_ACTIVITIES = 5
+DASHBOARD_MAX_TASKS = 50
+
+dashboard_cache = TTLCache(int(os.getenv('DASHBOARD_CACHE_SIZE', '10000')))
+# The summary's independent queries run side by side on this pool
+dashboard_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('DASHBOARD_QUERY_WORKERS', '8')),
+    thread_name_prefix='dashboard'
+)
+
+def invalidate_dashboard(*user_ids):
+    if not user_ids:
+        return
+    users.update_many(
+        {'_id': {'$in': [ObjectId(str(user_id)) for user_id in user_ids]}},
+        {'$inc': {'dashboard_version': 1}}
+    )
+    for user_id in user_ids:
+        dashboard_cache.pop(str(user_id))
+
+def dashboard_version(user_id):
+    user = users.find_one({'_id': user_id}, {'dashboard_version': 1}) or {}
+    return user.get('dashboard_version', 0)
+
+def start_of_today():
+    now = datetime.utcnow()
+    return datetime(now.year, now.month, now.day)
+
+def find_todays_tasks(user_id):
+    # Open tasks due today or earlier, plus the ones finished today
+    today = start_of_today()
+    return list(tasks.find(
+        {
+            'user_id': user_id,
+            'due_date': {'$lt': today + timedelta(days=1)},
+            '$or': [{'completed': False}, {'completed_at': {'$gte': today}}]
+        },
+        {'text': 1, 'completed': 1, 'due_date': 1}
+    ).sort('created_at', 1).limit(DASHBOARD_MAX_TASKS))
+
+@app.route('/api/tasks', methods=['GET'])
+@token_required
+def get_tasks(current_user):
+    return jsonify(find_todays_tasks(current_user['_id'])), 200
+
+@app.route('/api/tasks', methods=['POST'])
+@token_required
+def create_task(current_user):
+    data = request.get_json(silent=True) or {}
+    text = (data.get('text') or '').strip()
+    if not text:
+        return jsonify({'error': 'text is required'}), 400
+    
+    due_date = start_of_today()
+    if data.get('due_date'):
+        try:
+            due_date = datetime.combine(datetime.fromisoformat(data['due_date']).date(), datetime.min.time())
+        except ValueError:
+            return jsonify({'error': 'Invalid date format, use YYYY-MM-DD'}), 400
+    
+    now = datetime.utcnow()
+    result = tasks.insert_one({
+        'user_id': current_user['_id'],
+        'text': text,
+        'completed': False,
+        'completed_at': None,
+        'due_date': due_date,
+        'created_at': now,
+        'updated_at': now
+    })
+    invalidate_dashboard(current_user['_id'])
+    
+    activity_sink.record({
+        'user_id': current_user['_id'],
+        'category': 'task',
+        'action': 'create_task',
+        'timestamp': now,
+        'details': f"Task added: {text}",
+        'reference_id': result.inserted_id
+    })
+    
+    return jsonify({'success': True, 'task_id': result.inserted_id}), 201
+
+@app.route('/api/tasks/<task_id>', methods=['PATCH'])
+@token_required
+def update_task(current_user, task_id):
+    try:
+        task_oid = ObjectId(task_id)
+    except Exception:
+        return jsonify({'error': 'Invalid task id'}), 400
+    
+    data = request.get_json(silent=True) or {}
+    now = datetime.utcnow()
+    changes = {'updated_at': now}
+    if 'text' in data:
+        changes['text'] = str(data['text']).strip()
+    if 'completed' in data:
+        changes['completed'] = bool(data['completed'])
+        changes['completed_at'] = now if data['completed'] else None
+    
+    result = tasks.update_one({'_id': task_oid, 'user_id': current_user['_id']}, {'$set': changes})
+    if result.matched_count == 0:
+        return jsonify({'error': 'Task not found'}), 404
+    invalidate_dashboard(current_user['_id'])
+    
+    if changes.get('completed'):
+        activity_sink.record({
+            'user_id': current_user['_id'],
+            'category': 'task',
+            'action': 'complete_task',
+            'timestamp': now,
+            'details': 'Task completed',
+            'reference_id': task_oid
+        })
+    
+    return jsonify({'success': True}), 200
+
+@app.route('/api/dashboard/summary', methods=['GET'])
+@token_required
+def get_dashboard_summary(current_user):
+    """Everything the dashboard shows on load, in one response.
+
+    The four queries are independent and run concurrently; the combined
+    result is cached per user for DASHBOARD_CACHE_TTL seconds, or until
+    the user's dashboard_version changes.
+    """
+    user_id = current_user['_id']
+    cache_key = str(user_id)
+    # Read before the queries, so a write made while they run makes this
+    # summary stale rather than being missed
+    version = dashboard_version(user_id)
+    cached = dashboard_cache.get(cache_key)
+    if cached is not None and cached[0] == version:
+        return jsonify(dict(cached[1], cached=True)), 200
+    
+    queries = {
+        'tasks': lambda: find_todays_tasks(user_id),
+        'mood': lambda: mood_store.latest(user_id),
+        'latest_entry': lambda: diary_entries.find_one(
+            {'user_id': user_id}, DIARY_SUMMARY_PROJECTION, sort=[('created_at', -1), ('_id', -1)]
+        ),
+        'recent_activities': lambda: list(
+            activities.find({'user_id': user_id}, HISTORY_PROJECTION)
+            .sort([('timestamp', -1), ('_id', -1)])
+            .limit(DASHBOARD_RECENT_ACTIVITIES)
+        )
+    }
+    futures = {name: dashboard_executor.submit(query) for name, query in queries.items()}
+    try:
+        summary = {name: future.result() for name, future in futures.items()}
+    except Exception as e:
+        logger.error(f"Dashboard summary error: {str(e)}")
+        return jsonify({'error': 'Could not load dashboard'}), 500
+    
+    dashboard_cache.set(cache_key, (version, summary), time.time() + DASHBOARD_CACHE_TTL)
+    return jsonify(dict(summary, cached=False)), 200
+
+# === Mood tracking ===
+# How far back trends go when no from_date is given
+MOOD_TREND_DEFAULT_DAYS = {'day': 30, 'week': 12 * 7, 'month': 365}
+
+@app.route('/api/mood', methods=['POST'])
+@token_required
+def record_mood(current_user):
+    # mood is a label (happy, neutral, sad, ...) or a score from 1 to 5
+    data = request.get_json(silent=True) or {}
+    if data.get('mood') is None:
+        return jsonify({'error': 'mood is required'}), 400
+    
+    try:
+        entry = mood_store.record(current_user['_id'], data['mood'], note=data.get('note'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    invalidate_dashboard(current_user['_id'])
+    
+    activity_sink.record({
+        'user_id': current_user['_id'],
+        'category': 'mood',
+        'action': 'record_mood',
+        'timestamp': entry['created_at'],
+        'details': f"Mood recorded: {data['mood']}",
+        'reference_id': entry['_id']
+    })
+    
+    return jsonify({
+        'success': True,
+        'entry_id': entry['_id'],
+        'score': entry['score']
+    }), 201
+
+@app.route('/api/mood', methods=['GET'])
+@token_required
+def get_mood_trend(current_user):
+    """Mood trend from the precomputed rollups.
+
+    Query parameters:
+      period             - 'day' (default), 'week' or 'month'
+      from_date, to_date - inclusive YYYY-MM-DD range; defaults to the
+                           last MOOD_TREND_DEFAULT_DAYS[period] days
+    """
+    period = request.args.get('period', 'day')
+    if period not in MOOD_PERIODS:
+        return jsonify({'error': f"period must be one of: {', '.join(MOOD_PERIODS)}"}), 400
+    
+    try:
+        bounds = parse_date_range('start').get('start', {})
+    except ValueError:
+        return jsonify({'error': 'Invalid date format, use YYYY-MM-DD'}), 400
+    end = bounds.get('$lte', datetime.utcnow())
+    start = bounds.get('$gte', end - timedelta(days=MOOD_TREND_DEFAULT_DAYS[period]))
+    
+    return jsonify({
+        'period': period,
+        'buckets': mood_store.trend(current_user['_id'], period, start, end),
+        'latest': mood_store.latest(current_user['_id'])
+    }), 200
+
+# === Activity history timeline ===
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+HISTORY_CATEGORIES = ('account', 'chat', 'diary', 'goal', 'mood', 'task')
+# The timeline only renders these fields
+HISTORY_PROJECTION = {'category': 1, 'action': 1, 'timestamp': 1, 'details': 1, 'reference_id': 1}
+
+@app.route('/api/history/get-history', methods=['GET'])
+@token_required
+def get_history_timeline(current_user):
+    """Page through the user's activity log.
+
+    Query parameters:
+      from_date, to_date - inclusive YYYY-MM-DD range
+      category           - only activities of this category
+      sort               - 'newest' (default) or 'oldest'
+      limit, cursor      - keyset pagination on (timestamp, _id)
+
+    counts holds the number of activities per category within the date
+    range, regardless of the category filter, so the filter buttons can
+    show totals. It is computed for the first page only (no cursor); later
+    pages return counts and total as null so paging never rescans the range.
+    """
+    base_query = {'user_id': current_user['_id']}
+    try:
+        base_query.update(parse_date_range('timestamp'))
+    except ValueError:
+        return jsonify({'error': 'Invalid date format, use YYYY-MM-DD'}), 400
+    
+    query = dict(base_query)
+    category = request.args.get('category')
+    if category:
+        if category not in HISTORY_CATEGORIES:
+            return jsonify({'error': f"category must be one of: {', '.join(HISTORY_CATEGORIES)}"}), 400
+        query['category'] = category
+    
+    sort_order = request.args.get('sort', 'newest')
+    if sort_order not in ('newest', 'oldest'):
+        return jsonify({'error': "sort must be 'newest' or 'oldest'"}), 400
+    direction = -1 if sort_order == 'newest' else 1
+    
+    try:
+        limit = min(int(request.args.get('limit', HISTORY_PAGE_SIZE)), HISTORY_MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'limit must be a positive number'}), 400
+    
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            timestamp, activity_id = decode_cursor(cursor)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        op = '$lt' if direction == -1 else '$gt'
+        query['$or'] = [
+            {'timestamp': {op: timestamp}},
+            {'timestamp': timestamp, '_id': {op: activity_id}}
+        ]
+    
+    # Fetch one extra activity to know whether another page exists
+    items = list(
+        activities.find(query, HISTORY_PROJECTION)
+        .sort([('timestamp', direction), ('_id', direction)])
+        .limit(limit + 1)
+    )
+    next_cursor = encode_cursor(items[limit - 1], 'timestamp') if len(items) > limit else None
+    
+    counts = None
+    if not cursor:
+        counts = {
+            row['_id']: row['count']
+            for row in activities.aggregate([
+                {'$match': base_query},
+                {'$group': {'_id': '$category', 'count': {'$sum': 1}}}
+            ])
+        }
+    
+    return jsonify({
+        'activities': items[:limit],
+        'next_cursor': next_cursor,
+        'counts': counts,
+        'total': sum(counts.values()) if counts is not None else None
+    }), 200
+
 # Route to serve uploaded images
-@app.route('/uploads/<filename>')
+# Uploaded images never change once written (names are content hashes or
+# unique ids), so they can be cached by browsers and CDNs for a year
+UPLOAD_CACHE_SECONDS = 365 * 24 * 3600
+
+@app.route('/uploads/<path:filename>')
 def serve_upload(filename):
-    return send_from_directory(UPLOADS_DIR, filename)
+    # ?size=thumb|medium serves a downscaled WebP rendition
+    size = request.args.get('size', 'original')
+    if size != 'original' and size not in RENDITION_SIZES:
+        return jsonify({'error': f"size must be one of: original, {', '.join(RENDITION_SIZES)}"}), 400
+    
+    if not blob_store.exists(filename):
+        return jsonify({'error': 'File not found'}), 404
+    
+    key = filename
+    if size != 'original':
+        try:
+            key = ensure_rendition(blob_store, filename, size)
+        except Exception as e:
+            logger.error(f"Error generating {size} rendition for {filename}: {str(e)}")
+            return jsonify({'error': 'Could not generate image rendition'}), 500
+    path = blob_store.local_path(key)
+    
+    # conditional=True answers If-None-Match with 304 and honours Range requests
+    response = send_file(
+        path,
+        conditional=True,
+        etag=f"{filename}-{size}",
+        max_age=UPLOAD_CACHE_SECONDS
+    )
+    response.headers['Cache-Control'] = f"public, max-age={UPLOAD_CACHE_SECONDS}, immutable"
+    return response
 
 @app.route('/dashboard')
 def dashboard():
@@ -714,14 +1643,11 @@ def voice():
         return redirect(url_for('index'))
     return render_template('index.html')
 
-@app.route('/history')
-def history():
-    if 'user_id' not in session:
-        return redirect(url_for('index'))
-    return render_template('history.html')
-
-
 
+if STARTUP_MODE == 'eager':
+    warm_up()
+elif STARTUP_MODE == 'background':
+    start_background_warm_up()
 
 if __name__ == '__main__':
     logger.info("Starting Flask application")
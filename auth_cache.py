@@ -0,0 +1,55 @@
+"""In-process caches for authentication.
+
+token_required used to run jwt.decode and fetch the full user document
+(password hash included) on every API call. AuthCache memoizes verified
+token claims until the token expires and keeps a TTL-bounded cache of the
+few user fields the handlers need.
+"""
+import time
+
+from bson import ObjectId
+import jwt
+
+from ttl_cache import TTLCache
+
+# Only what the handlers and templates use; never the password hash
+USER_PROJECTION = {'name': 1, 'email': 1}
+
+
+class AuthCache:
+    def __init__(self, users, secret_key, user_ttl=60, max_entries=10000):
+        self.users = users
+        self.secret_key = secret_key
+        self.user_ttl = user_ttl
+        self._tokens = TTLCache(max_entries)
+        self._users = TTLCache(max_entries)
+
+    def verify_token(self, token):
+        """Return the token's claims, decoding it only on a cache miss.
+
+        Raises the usual jwt exceptions for invalid or expired tokens.
+        """
+        claims = self._tokens.get(token)
+        if claims is None:
+            claims = jwt.decode(token, self.secret_key, algorithms=['HS256'])
+            # Tokens without an expiry are only remembered for the user TTL
+            self._tokens.set(token, claims, claims.get('exp', time.time() + self.user_ttl))
+        return claims
+
+    def get_user(self, user_id):
+        """Return {'_id', 'name', 'email'} for user_id, or None if it does not exist."""
+        user_id = str(user_id)
+        user = self._users.get(user_id)
+        if user is None:
+            user = self.users.find_one({'_id': ObjectId(user_id)}, USER_PROJECTION)
+            if user is None:
+                return None
+            self._users.set(user_id, user, time.time() + self.user_ttl)
+        # Handlers get their own copy so they cannot modify the cached entry
+        return dict(user)
+
+    def invalidate_user(self, user_id):
+        self._users.pop(str(user_id))
+
+    def forget_token(self, token):
+        self._tokens.pop(token)
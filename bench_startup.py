@@ -0,0 +1,65 @@
+"""Startup-time benchmark for app.py.
+
+Each run happens in a fresh interpreter so module caches do not hide the
+real cold-start cost. For every startup mode it reports how long
+`import app` takes and the latency of the first request to a few routes.
+
+    python bench_startup.py
+    python bench_startup.py --modes lazy eager --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROBE = r'''
+import json, sys, time
+t0 = time.perf_counter()
+import app
+import_seconds = time.perf_counter() - t0
+results = {'import': import_seconds}
+client = app.app.test_client()
+for path in sys.argv[1:]:
+    t0 = time.perf_counter()
+    response = client.get(path)
+    results[f'first GET {path} ({response.status_code})'] = time.perf_counter() - t0
+print(json.dumps(results))
+'''
+
+DEFAULT_PATHS = ['/healthz', '/', '/readyz']
+
+
+def run_once(mode, paths):
+    env = dict(os.environ, STARTUP_MODE=mode)
+    completed = subprocess.run(
+        [sys.executable, '-c', PROBE] + paths,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Probe failed in {mode} mode:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', nargs='+', default=['lazy', 'eager'])
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--paths', nargs='+', default=DEFAULT_PATHS)
+    args = parser.parse_args()
+
+    for mode in args.modes:
+        samples = {}
+        for _ in range(args.runs):
+            for name, seconds in run_once(mode, args.paths).items():
+                samples.setdefault(name, []).append(seconds)
+        print(f"STARTUP_MODE={mode} ({args.runs} runs)")
+        for name, values in samples.items():
+            print(f"  {name:<40} median {statistics.median(values) * 1000:8.1f} ms"
+                  f"   max {max(values) * 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
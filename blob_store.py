@@ -0,0 +1,254 @@
+"""Content-addressed storage for diary images.
+
+Images are stored under the SHA-256 of their bytes in sharded
+subdirectories:
+
+    ab/cd/abcd1234....jpeg
+
+so identical uploads are stored once and no directory grows without
+bound. Derived objects such as renditions are stored under keys computed
+from the original's key. The backend is pluggable (BLOB_STORE_BACKEND);
+only the local filesystem exists today, and an object store can be added
+by implementing the same methods.
+
+OrphanCollector removes blobs that no diary entry references any more.
+"""
+from datetime import datetime, timedelta
+import hashlib
+import logging
+import os
+import re
+import socket
+import threading
+import time
+import uuid
+
+from pymongo.errors import DuplicateKeyError
+from werkzeug.security import safe_join
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS_PREFIX = 'renditions'
+# Blobs checked against diary_entries per query
+GC_BATCH_SIZE = 500
+GC_LEASE_ID = 'blob-gc'
+
+
+def content_key(data, ext):
+    digest = hashlib.sha256(data).hexdigest()
+    return f"{digest[:2]}/{digest[2:4]}/{digest}.{ext}"
+
+
+class LocalBlobStore:
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        path = safe_join(self.root, key)
+        if path is None:
+            raise ValueError(f"Invalid blob key: {key}")
+        return path
+
+    def _write(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write under a temporary name so readers never see partial files
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def put(self, data, ext):
+        """Store data under its content hash and return the key."""
+        key = content_key(data, ext)
+        if self.exists(key):
+            logger.debug(f"Deduplicated blob {key}")
+            # Refresh the mtime so the orphan collector's grace period restarts
+            self.touch(key)
+        else:
+            self._write(key, data)
+        return key
+
+    def put_derived(self, key, data):
+        self._write(key, data)
+        return key
+
+    def touch(self, key):
+        os.utime(self._path(key))
+
+    def mtime(self, key):
+        """Modification time of key, or None if it does not exist."""
+        try:
+            return os.path.getmtime(self._path(key))
+        except (OSError, ValueError):
+            return None
+
+    def exists(self, key):
+        try:
+            return os.path.isfile(self._path(key))
+        except ValueError:
+            return False
+
+    def open(self, key):
+        return open(self._path(key), 'rb')
+
+    def local_path(self, key):
+        """Filesystem path for key, for backends that have one."""
+        return self._path(key)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def iter_keys(self):
+        """Yield (key, modified_time) for every stored blob."""
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(dirpath, name)
+                key = os.path.relpath(path, self.root).replace(os.sep, '/')
+                yield key, os.path.getmtime(path)
+
+
+BLOB_STORES = {
+    'local': LocalBlobStore,
+}
+
+
+def create_blob_store(name, **kwargs):
+    try:
+        return BLOB_STORES[name](**kwargs)
+    except KeyError:
+        raise ValueError(f"Unknown blob store '{name}', expected one of {sorted(BLOB_STORES)}")
+
+
+def rendition_key(key, size):
+    stem = os.path.splitext(key)[0]
+    return f"{RENDITIONS_PREFIX}/{size}/{stem}.webp"
+
+
+class OrphanCollector:
+    """Periodically deletes blobs that no diary entry references.
+
+    Blobs younger than grace_seconds are kept, so images written by a
+    request that has not inserted its diary entry yet are never removed.
+    Candidates are checked in batches against the images.filename index,
+    so memory use does not grow with the number of stored images.
+
+    With a leases collection, every process runs the loop but at most one
+    collection per interval happens across all of them: a run first has to
+    claim the lease document, which expires after interval seconds.
+    """
+
+    def __init__(self, store, diary_entries, interval=3600, grace_seconds=3600,
+                 leases=None, batch_size=GC_BATCH_SIZE):
+        self.store = store
+        self.diary_entries = diary_entries
+        self.interval = interval
+        self.grace_seconds = grace_seconds
+        self.leases = leases
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+
+    def _claim_run(self):
+        """Return True if this process should collect now."""
+        if self.leases is None:
+            return True
+        now = datetime.utcnow()
+        try:
+            # Matches only an expired lease; otherwise the upsert collides
+            # with the existing _id
+            self.leases.find_one_and_update(
+                {'_id': GC_LEASE_ID, 'expires_at': {'$lte': now}},
+                {'$set': {
+                    'expires_at': now + timedelta(seconds=self.interval),
+                    'holder': f"{socket.gethostname()}:{os.getpid()}"
+                }},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    def _referenced(self, keys):
+        """Return the subset of keys still referenced by a diary entry."""
+        originals = []
+        stems = {}
+        for key in keys:
+            if key.startswith(RENDITIONS_PREFIX + '/'):
+                # renditions/<size>/<original stem>.webp
+                stem = os.path.splitext(key.split('/', 2)[2])[0]
+                stems.setdefault(stem, []).append(key)
+            else:
+                originals.append(key)
+
+        clauses = []
+        if originals:
+            clauses.append({'images.filename': {'$in': originals}})
+        if stems:
+            # Anchored prefixes can use the images.filename index
+            patterns = [re.compile('^' + re.escape(stem + '.')) for stem in stems]
+            clauses.append({'images.filename': {'$in': patterns}})
+        if not clauses:
+            return set()
+
+        query = clauses[0] if len(clauses) == 1 else {'$or': clauses}
+        filenames = set()
+        for entry in self.diary_entries.find(query, {'_id': 0, 'images.filename': 1}):
+            for image in entry.get('images') or []:
+                if image.get('filename'):
+                    filenames.add(image['filename'])
+
+        referenced = {key for key in originals if key in filenames}
+        for filename in filenames:
+            referenced.update(stems.get(os.path.splitext(filename)[0], ()))
+        return referenced
+
+    def _collect_batch(self, keys, cutoff):
+        referenced = self._referenced(keys)
+        removed = 0
+        for key in keys:
+            if key in referenced:
+                continue
+            # A deduplicated upload may have touched the blob (or, for a
+            # rendition, the rendition itself) since the walk saw it
+            modified = self.store.mtime(key)
+            if modified is None or modified > cutoff:
+                continue
+            self.store.delete(key)
+            removed += 1
+        return removed
+
+    def collect(self):
+        cutoff = time.time() - self.grace_seconds
+        removed = 0
+        batch = []
+        for key, modified in self.store.iter_keys():
+            if modified > cutoff:
+                continue
+            batch.append(key)
+            if len(batch) >= self.batch_size:
+                removed += self._collect_batch(batch, cutoff)
+                batch = []
+        if batch:
+            removed += self._collect_batch(batch, cutoff)
+        logger.info(f"Blob garbage collection removed {removed} orphaned blobs")
+        return removed
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if self._claim_run():
+                    self.collect()
+            except Exception as e:
+                logger.error(f"Blob garbage collection failed: {str(e)}")
+
+    def start(self):
+        threading.Thread(target=self._run, name='blob-gc', daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,142 @@
+"""MongoDB index bootstrap and query-plan verification.
+
+INDEXES declares every index the app relies on. ensure_indexes() applies
+them idempotently and runs during app warm-up. verify_query_plans() runs
+explain() on each hot query and reports any that fall back to a
+collection scan.
+
+    python db_indexes.py            # create missing indexes
+    python db_indexes.py --check    # create, then fail if a hot query uses COLLSCAN
+"""
+from datetime import datetime, timedelta
+import argparse
+import logging
+import os
+import sys
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel, MongoClient
+
+logger = logging.getLogger(__name__)
+
+INDEXES = {
+    'users': [
+        IndexModel([('email', ASCENDING)], name='email_unique', unique=True),
+    ],
+    'diary_entries': [
+        # _id breaks ties in the keyset pagination order
+        IndexModel([('user_id', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)],
+                   name='user_created_id'),
+        IndexModel([('user_id', ASCENDING), ('year', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)],
+                   name='user_year_created_id'),
+        # One text index per collection; the user_id prefix keeps each
+        # search inside a single user's entries
+        IndexModel([('user_id', ASCENDING), ('title', TEXT), ('content', TEXT), ('tags', TEXT)],
+                   name='user_text', weights={'title': 5, 'tags': 3, 'content': 1}),
+        IndexModel([('user_id', ASCENDING), ('tags', ASCENDING), ('created_at', DESCENDING)],
+                   name='user_tags_created'),
+        # Blob garbage collection checks stored images against this
+        IndexModel([('images.filename', ASCENDING)], name='images_filename'),
+    ],
+    'tasks': [
+        IndexModel([('user_id', ASCENDING), ('due_date', ASCENDING), ('created_at', ASCENDING)],
+                   name='user_due_created'),
+    ],
+    'mood_entries': [
+        IndexModel([('user_id', ASCENDING), ('created_at', DESCENDING)], name='user_created'),
+    ],
+    'mood_rollups': [
+        # One bucket per user, period and start; upserts rely on it being unique
+        IndexModel([('user_id', ASCENDING), ('period', ASCENDING), ('start', ASCENDING)],
+                   name='user_period_start', unique=True),
+    ],
+    'activities': [
+        # _id breaks ties in the history timeline's keyset pagination
+        IndexModel([('user_id', ASCENDING), ('timestamp', DESCENDING), ('_id', DESCENDING)],
+                   name='user_timestamp_id'),
+        IndexModel([('user_id', ASCENDING), ('category', ASCENDING), ('timestamp', DESCENDING), ('_id', DESCENDING)],
+                   name='user_category_timestamp_id'),
+    ],
+}
+
+
+# Each hot query is (description, function returning an unevaluated cursor)
+HOT_QUERIES = [
+    ('users by email',
+     lambda db: db['users'].find({'email': 'someone@example.com'})),
+    ('diary entries by user, newest first',
+     lambda db: db['diary_entries'].find({'user_id': ObjectId()}).sort([('created_at', -1), ('_id', -1)])),
+    ('diary entries by user and year',
+     lambda db: db['diary_entries'].find({'user_id': ObjectId(), 'year': 2024}).sort([('created_at', -1), ('_id', -1)])),
+    ('diary entry by user and date',
+     lambda db: db['diary_entries'].find({
+         'user_id': ObjectId(),
+         'created_at': {'$gte': datetime(2024, 1, 1), '$lte': datetime(2024, 1, 1) + timedelta(days=1)}
+     })),
+    ('diary text search',
+     lambda db: db['diary_entries'].find({'user_id': ObjectId(), '$text': {'$search': 'anxious'}})),
+    ('diary entries by user and tag',
+     lambda db: db['diary_entries'].find({'user_id': ObjectId(), 'tags': {'$all': ['work']}}).sort('created_at', -1)),
+    ('diary entries referencing a blob',
+     lambda db: db['diary_entries'].find({'images.filename': {'$in': ['ab/cd/abcd.jpeg']}})),
+    ('tasks due by today',
+     lambda db: db['tasks'].find({'user_id': ObjectId(), 'due_date': {'$lt': datetime(2024, 1, 2)}}).sort('created_at', 1)),
+    ('latest mood entry',
+     lambda db: db['mood_entries'].find({'user_id': ObjectId()}).sort('created_at', -1).limit(1)),
+    ('mood trend buckets',
+     lambda db: db['mood_rollups'].find({'user_id': ObjectId(), 'period': 'day', 'start': {'$gte': datetime(2024, 1, 1)}}).sort('start', 1)),
+    ('activities by user and category, newest first',
+     lambda db: db['activities'].find({'user_id': ObjectId(), 'category': 'diary'}).sort([('timestamp', -1), ('_id', -1)])),
+    ('activities by user, newest first',
+     lambda db: db['activities'].find({'user_id': ObjectId()}).sort([('timestamp', -1), ('_id', -1)])),
+]
+
+
+def ensure_indexes(db):
+    """Create any missing indexes. Safe to call on every startup."""
+    for collection_name, models in INDEXES.items():
+        created = db[collection_name].create_indexes(models)
+        logger.info(f"Indexes on {collection_name}: {', '.join(created)}")
+
+
+def _plan_stages(plan):
+    yield plan.get('stage')
+    if 'inputStage' in plan:
+        yield from _plan_stages(plan['inputStage'])
+    for stage in plan.get('inputStages', []):
+        yield from _plan_stages(stage)
+    # Slot-based engine plans wrap the classic plan in queryPlan
+    if 'queryPlan' in plan:
+        yield from _plan_stages(plan['queryPlan'])
+
+
+def verify_query_plans(db):
+    """Return a list of (description, stages) for hot queries that use COLLSCAN."""
+    failures = []
+    for description, make_cursor in HOT_QUERIES:
+        plan = make_cursor(db).explain()['queryPlanner']['winningPlan']
+        stages = [stage for stage in _plan_stages(plan) if stage]
+        if 'COLLSCAN' in stages:
+            failures.append((description, stages))
+            logger.error(f"Query '{description}' uses a collection scan: {stages}")
+        else:
+            logger.info(f"Query '{description}' plan: {' <- '.join(stages)}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create MongoDB indexes and verify query plans.')
+    parser.add_argument('--check', action='store_true', help='fail if a hot query uses COLLSCAN')
+    parser.add_argument('--uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017/'))
+    parser.add_argument('--db', default=os.getenv('MONGO_DB', 'mindmate_db'))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db = MongoClient(args.uri, serverSelectionTimeoutMS=5000)[args.db]
+    ensure_indexes(db)
+    if args.check and verify_query_plans(db):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
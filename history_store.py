@@ -0,0 +1,127 @@
+"""Server-side conversation history.
+
+History used to live in Flask's cookie session, which meant every request
+carried several KB of signed cookie. It is now stored in the
+`chat_sessions` collection, one document per chat session:
+
+    {'_id': <session id>, 'history': [{'user': ..., 'ai': ...}],
+     'summary': <running summary of older turns>, 'updated_at': ...}
+
+and the cookie only carries the session id. Reads go through a small
+in-process LRU cache; writes go to MongoDB first and refresh the cache
+with the stored document, so a worker never caches history it did not
+read back from the database. Entries expire after a short TTL so other
+workers' writes become visible.
+"""
+from datetime import datetime
+import time
+
+from pymongo import ReturnDocument
+
+from ttl_cache import TTLCache
+
+
+class ChatHistoryStore:
+    """History window of at most max_length exchanges.
+
+    With max_tokens (and turn_tokens, which returns an exchange's token
+    cost), the window is also cut to the newest exchanges that fit in
+    max_tokens, so every stored exchange fits in the prompt and everything
+    older is evicted to the summarizer.
+    """
+
+    def __init__(self, collection, max_length, cache_size=1024, cache_ttl=30,
+                 max_tokens=None, turn_tokens=None):
+        self.collection = collection
+        self.max_length = max_length
+        self.max_tokens = max_tokens
+        self.turn_tokens = turn_tokens
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._cache = TTLCache(cache_size)  # session id -> {'history', 'summary'}
+
+    def _cache_set(self, session_id, history, summary=None):
+        doc = {'history': list(history), 'summary': summary}
+        self._cache.set(session_id, doc, time.time() + self.cache_ttl)
+        return doc
+
+    def _load(self, session_id):
+        doc = self._cache.get(session_id)
+        if doc is not None:
+            return doc
+        stored = self.collection.find_one({'_id': session_id}, {'history': 1, 'summary': 1}) or {}
+        return self._cache_set(session_id, stored.get('history', []), stored.get('summary'))
+
+    def get(self, session_id):
+        return list(self._load(session_id)['history'])
+
+    def get_summary(self, session_id):
+        return self._load(session_id)['summary']
+
+    def _fit(self, history):
+        # Newest exchanges that fit in max_tokens, kept contiguous
+        if self.max_tokens is None:
+            return history
+        remaining = self.max_tokens
+        kept = 0
+        for entry in reversed(history):
+            remaining -= self.turn_tokens(entry)
+            if remaining < 0:
+                break
+            kept += 1
+        return history[len(history) - kept:]
+
+    def append(self, session_id, user_input, ai_response):
+        """Append one exchange and return the exchanges evicted from the window."""
+        entry = {'user': user_input, 'ai': ai_response}
+        # $slice keeps only the last max_length exchanges in the document.
+        # The previous document is returned so evicted exchanges can be
+        # handed to the summarizer.
+        before = self.collection.find_one_and_update(
+            {'_id': session_id},
+            {
+                '$push': {'history': {'$each': [entry], '$slice': -self.max_length}},
+                '$set': {'updated_at': datetime.utcnow()}
+            },
+            projection={'history': 1, 'summary': 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        ) or {}
+        history = before.get('history', []) + [entry]
+        window = self._fit(history[-self.max_length:])
+        if len(window) < min(len(history), self.max_length):
+            # Over the token budget; trim the stored window to match
+            self.collection.update_one(
+                {'_id': session_id},
+                {'$push': {'history': {'$each': [], '$slice': -len(window)}}}
+            )
+        evicted = history[:len(history) - len(window)]
+        self._cache_set(session_id, window, before.get('summary'))
+        return evicted
+
+    def set_summary(self, session_id, summary, since=None):
+        """Store the running summary; returns False if it was not stored.
+
+        With since, the summary is only stored if the session has not been
+        cleared after that time, so a summary of a cleared conversation
+        never comes back.
+        """
+        query = {'_id': session_id}
+        if since is not None:
+            query['$or'] = [{'cleared_at': {'$exists': False}}, {'cleared_at': {'$lt': since}}]
+        result = self.collection.update_one(
+            query,
+            {'$set': {'summary': summary, 'updated_at': datetime.utcnow()}},
+            upsert=since is None
+        )
+        # Force the next read to pick up the new summary
+        self._cache.pop(session_id)
+        return since is None or result.matched_count > 0
+
+    def clear(self, session_id):
+        now = datetime.utcnow()
+        self.collection.update_one(
+            {'_id': session_id},
+            {'$set': {'history': [], 'summary': None, 'cleared_at': now, 'updated_at': now}}
+        )
+        self._cache_set(session_id, [])
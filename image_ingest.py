@@ -0,0 +1,112 @@
+"""Off-thread verification and re-encoding of diary images.
+
+Decoding and re-saving photos is CPU heavy, so it runs on a shared worker
+pool instead of the request thread. A semaphore bounds how many images
+are waiting or being processed across all requests; when it is exhausted
+callers wait briefly and then get ImageIngestBusy so the route can answer
+503 rather than piling up memory.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import io
+import logging
+import os
+import threading
+
+from PIL import Image
+
+from image_renditions import create_renditions
+
+logger = logging.getLogger(__name__)
+
+# Formats we accept, mapped to the file extension they are stored with
+ALLOWED_FORMATS = {'JPEG': 'jpeg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+
+
+class ImageIngestError(Exception):
+    pass
+
+
+class ImageTooLarge(ImageIngestError):
+    pass
+
+
+class ImageIngestBusy(ImageIngestError):
+    pass
+
+
+def stream_size(stream):
+    position = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(position)
+    return size
+
+
+class ImageIngestor:
+    def __init__(self, store, max_image_bytes=10 * 1024 * 1024, max_workers=2,
+                 max_pending=16, acquire_timeout=10):
+        self.store = store
+        self.max_image_bytes = max_image_bytes
+        self.acquire_timeout = acquire_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='image')
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def _process(self, stream, original_name):
+        try:
+            stream.seek(0)
+            with Image.open(stream) as img:
+                img.verify()  # Cheap structural check before decoding
+            stream.seek(0)
+            with Image.open(stream) as img:
+                if img.format not in ALLOWED_FORMATS:
+                    raise ImageIngestError(f"Unsupported image format: {img.format}")
+                buffer = io.BytesIO()
+                img.save(buffer, format=img.format)
+                # Stored under its content hash, so repeated uploads of the
+                # same photo share one blob
+                filename = self.store.put(buffer.getvalue(), ALLOWED_FORMATS[img.format])
+                # Gallery thumbnails are produced here, off the request thread
+                try:
+                    create_renditions(img, self.store, filename)
+                except Exception as e:
+                    logger.warning(f"Could not create renditions for {filename}: {str(e)}")
+            return {
+                'filename': filename,
+                'original_name': original_name
+            }
+        finally:
+            self._slots.release()
+
+    def submit(self, stream, original_name='unknown'):
+        """Queue a seekable image stream; returns a future for its image record."""
+        if stream_size(stream) > self.max_image_bytes:
+            raise ImageTooLarge(f"Image exceeds {self.max_image_bytes} bytes")
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise ImageIngestBusy("Too many images are being processed")
+        try:
+            return self._executor.submit(self._process, stream, original_name)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def ingest(self, items):
+        """Process (stream, original_name) pairs concurrently.
+
+        Returns the records of the images that were saved, in input order.
+        Images that fail verification are logged and skipped.
+        """
+        futures = []
+        try:
+            for stream, original_name in items:
+                try:
+                    futures.append(self.submit(stream, original_name))
+                except ImageTooLarge as e:
+                    logger.warning(f"Skipping image {original_name}: {str(e)}")
+        finally:
+            images = []
+            for future in futures:
+                try:
+                    images.append(future.result())
+                except Exception as e:
+                    logger.error(f"Error saving image: {str(e)}")
+        return images
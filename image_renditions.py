@@ -0,0 +1,52 @@
+"""Downscaled WebP renditions of diary images.
+
+Galleries only need small images, so every upload gets a thumbnail and a
+medium rendition. They are generated on the image worker pool at ingest
+time, or lazily on first request for images uploaded before renditions
+existed, and stored in the blob store under blob_store.rendition_key().
+"""
+import io
+import logging
+
+from PIL import Image
+
+from blob_store import rendition_key
+
+logger = logging.getLogger(__name__)
+
+# Longest edge in pixels for each rendition
+RENDITION_SIZES = {'thumb': 320, 'medium': 1024}
+RENDITION_QUALITY = 80
+
+
+def encode_rendition(img, max_dimension):
+    rendition = img.copy()
+    rendition.thumbnail((max_dimension, max_dimension))
+    if rendition.mode not in ('RGB', 'RGBA'):
+        has_alpha = rendition.mode in ('LA', 'PA') or 'transparency' in rendition.info
+        rendition = rendition.convert('RGBA' if has_alpha else 'RGB')
+    buffer = io.BytesIO()
+    rendition.save(buffer, format='WEBP', quality=RENDITION_QUALITY)
+    return buffer.getvalue()
+
+
+def create_renditions(img, store, key):
+    """Store every rendition for an already opened image."""
+    for size, max_dimension in RENDITION_SIZES.items():
+        derived_key = rendition_key(key, size)
+        # Deduplicated uploads already have their renditions; refresh them
+        # so the orphan collector's grace period restarts for them too
+        if store.exists(derived_key):
+            store.touch(derived_key)
+        else:
+            store.put_derived(derived_key, encode_rendition(img, max_dimension))
+
+
+def ensure_rendition(store, key, size):
+    """Return the rendition key, generating it from the original if missing."""
+    derived_key = rendition_key(key, size)
+    if not store.exists(derived_key):
+        logger.info(f"Generating {size} rendition for {key}")
+        with store.open(key) as f, Image.open(f) as img:
+            store.put_derived(derived_key, encode_rendition(img, RENDITION_SIZES[size]))
+    return derived_key
@@ -0,0 +1,66 @@
+"""Flask JSON provider that understands MongoDB documents.
+
+Handlers can return documents straight from PyMongo: ObjectId becomes its
+hex string, datetimes become ISO 8601 strings, and other BSON types are
+converted wherever they are nested. Encoding uses orjson when it is
+installed and falls back to the standard json module otherwise.
+"""
+from datetime import date, datetime
+import base64
+import json
+
+from bson import Decimal128, ObjectId
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def bson_default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal128):
+        return str(obj.to_decimal())
+    if isinstance(obj, bytes):
+        return base64.b64encode(obj).decode()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class MongoJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        if orjson is None:
+            kwargs.setdefault('default', bson_default)
+            kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+            kwargs.setdefault('sort_keys', self.sort_keys)
+            return json.dumps(obj, **kwargs)
+        return self._orjson_dumps(obj, **kwargs).decode()
+
+    def _orjson_dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=bson_default, option=option)
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return json.loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self.compact is False or (self.compact is None and self._app.debug)
+        # orjson produces bytes, which go straight into the response body
+        return self._app.response_class(
+            self._orjson_dumps(obj, indent=indent) + b"\n",
+            mimetype=self.mimetype
+        )
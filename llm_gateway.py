@@ -0,0 +1,439 @@
+"""Resilient access to the chat LLM.
+
+All chat traffic goes through an LLMGateway, which wraps a pluggable
+backend with:
+
+- a cap on concurrent upstream calls,
+- per-request deadlines (for streams: a deadline for the first chunk and
+  a maximum gap between chunks, so long healthy replies are not cut off),
+- retries with exponential backoff and full jitter,
+- optional hedged requests: when a call is still running after the
+  observed p95 latency, a second identical call is started and the first
+  answer wins,
+- a circuit breaker that fails fast while the upstream is unhealthy.
+
+Backends are selected by name (LLM_BACKEND): 'groq' talks to Groq through
+a pooled HTTP client, 'stub' answers locally and is meant for tests and
+offline development.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import logging
+import queue
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LLMError(Exception):
+    pass
+
+
+class LLMTimeout(LLMError):
+    pass
+
+
+class LLMBusy(LLMTimeout):
+    """No concurrency slot freed up before the deadline."""
+
+
+class CircuitOpenError(LLMError):
+    pass
+
+
+# === Backends ===
+class GroqBackend:
+    """ChatGroq with a shared, pooled HTTP client. Created on first use."""
+
+    def __init__(self, api_key, model_name="llama-3.3-70b-versatile", temperature=0.6,
+                 max_connections=20, request_timeout=60):
+        self.api_key = api_key
+        self.model_name = model_name
+        self.temperature = temperature
+        self.max_connections = max_connections
+        self.request_timeout = request_timeout
+        self._llm = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._llm is not None
+
+    def load(self):
+        if self._llm is None:
+            with self._lock:
+                if self._llm is None:
+                    import httpx
+                    from langchain_groq import ChatGroq
+
+                    logger.info("Initializing Groq LLM...")
+                    http_client = httpx.Client(
+                        limits=httpx.Limits(
+                            max_connections=self.max_connections,
+                            max_keepalive_connections=self.max_connections
+                        ),
+                        timeout=self.request_timeout
+                    )
+                    self._llm = ChatGroq(
+                        temperature=self.temperature,
+                        groq_api_key=self.api_key,
+                        model_name=self.model_name,
+                        request_timeout=self.request_timeout,
+                        max_retries=0,  # Retries are handled by the gateway
+                        http_client=http_client
+                    )
+                    logger.info("Groq LLM initialized successfully")
+        return self._llm
+
+    def invoke(self, prompt):
+        response = self.load().invoke(prompt)
+        return response.content if hasattr(response, 'content') else str(response)
+
+    def stream(self, prompt):
+        for chunk in self.load().stream(prompt):
+            yield chunk.content if hasattr(chunk, 'content') else str(chunk)
+
+
+class StubBackend:
+    """Local backend that answers without any network access."""
+
+    loaded = True
+
+    def __init__(self, reply=None, latency=0.0, failure_rate=0.0):
+        self.reply = reply
+        self.latency = latency
+        self.failure_rate = failure_rate
+
+    def load(self):
+        return self
+
+    def _answer(self, prompt):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise LLMError("Stub backend failure")
+        if self.reply is not None:
+            return self.reply
+        last_line = prompt.rsplit("Current user message:", 1)[-1].strip().splitlines()[0]
+        return f"I hear you. You said: {last_line}"
+
+    def invoke(self, prompt):
+        return self._answer(prompt)
+
+    def stream(self, prompt):
+        for word in self._answer(prompt).split(" "):
+            yield word + " "
+
+
+BACKENDS = {
+    'groq': GroqBackend,
+    'stub': StubBackend,
+}
+
+
+def create_backend(name, **kwargs):
+    try:
+        return BACKENDS[name](**kwargs)
+    except KeyError:
+        raise ValueError(f"Unknown LLM backend '{name}', expected one of {sorted(BACKENDS)}")
+
+
+# === Circuit breaker ===
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures.
+
+    While open every call fails fast. After `reset_timeout` seconds a
+    single trial call is let through; its outcome closes or re-opens the
+    breaker. A trial that ends without an upstream outcome (the caller
+    went away, or it never got a slot) must call release_trial() so the
+    next call can try again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        """Return 'closed' or 'trial' if a call may go ahead, False otherwise."""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return 'closed'
+            if state == 'half-open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return 'trial'
+            return False
+
+    def release_trial(self):
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+# === Gateway ===
+class LLMGateway:
+    def __init__(self, backend, max_concurrency=8, timeout=30, max_retries=2,
+                 backoff_base=0.25, backoff_max=4.0, hedge=False, hedge_min_samples=20,
+                 breaker=None, stream_idle_timeout=15):
+        self.backend = backend
+        self.timeout = timeout
+        self.stream_idle_timeout = stream_idle_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+        # One slot per upstream call in flight, held until the call really
+        # ends, so calls abandoned at their deadline still count
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency * 2, thread_name_prefix='llm')
+        # Full completion times of invoke calls; these set the hedge delay
+        self._latencies = deque(maxlen=200)
+        # Time to first chunk of streams, reported only
+        self._first_chunk_latencies = deque(maxlen=200)
+        self._latency_lock = threading.Lock()
+
+    # --- latency tracking ---
+    def _record_latency(self, seconds, samples=None):
+        with self._latency_lock:
+            (self._latencies if samples is None else samples).append(seconds)
+
+    def _p95(self, samples):
+        with self._latency_lock:
+            if len(samples) < self.hedge_min_samples:
+                return None
+            ordered = sorted(samples)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def p95_latency(self):
+        return self._p95(self._latencies)
+
+    # --- helpers ---
+    def _backoff(self, attempt):
+        # Full jitter: sleep a random time up to the exponential backoff cap
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _allow(self):
+        """Return True for a half-open trial call; raise if the breaker is open."""
+        permit = self.breaker.allow()
+        if not permit:
+            raise CircuitOpenError("LLM circuit breaker is open")
+        return permit == 'trial'
+
+    def _timed_invoke(self, prompt):
+        started = time.monotonic()
+        result = self.backend.invoke(prompt)
+        self._record_latency(time.monotonic() - started)
+        return result
+
+    def _submit(self, prompt, wait_seconds):
+        """Start an upstream call once a slot is free; None if none freed up in time."""
+        if not self._slots.acquire(timeout=max(0, wait_seconds)):
+            return None
+        try:
+            future = self._executor.submit(self._timed_invoke, prompt)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _invoke_once(self, prompt, deadline):
+        first = self._submit(prompt, deadline - time.monotonic())
+        if first is None:
+            raise LLMBusy("Timed out waiting for an LLM slot")
+        pending = {first}
+        hedge_after = self.p95_latency() if self.hedge else None
+        hedged = False
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LLMTimeout("LLM request exceeded its deadline")
+            wait_for = remaining
+            if hedge_after is not None and not hedged:
+                wait_for = min(remaining, hedge_after)
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+            if done and not pending:
+                raise done.pop().exception()
+            if not done and hedge_after is not None and not hedged:
+                hedged = True
+                # Only hedge with a spare slot; never wait for one
+                hedge = self._submit(prompt, 0)
+                if hedge is not None:
+                    logger.info(f"LLM call slower than p95 ({hedge_after:.2f}s), sending hedged request")
+                    pending.add(hedge)
+
+    def _pump(self, prompt, chunks, cancelled):
+        # Runs on the executor and owns a slot until the upstream stream
+        # really ends, so a hung upstream keeps counting against the cap
+        try:
+            upstream = self.backend.stream(prompt)
+            try:
+                for chunk in upstream:
+                    if cancelled.is_set():
+                        return
+                    chunks.put(('chunk', chunk))
+                chunks.put(('end', None))
+            finally:
+                if hasattr(upstream, 'close'):
+                    upstream.close()
+        except Exception as e:
+            chunks.put(('error', e))
+        finally:
+            self._slots.release()
+
+    def _open_stream(self, prompt, wait_seconds):
+        """Start reading an upstream stream; None if no slot freed up in time."""
+        if not self._slots.acquire(timeout=max(0, wait_seconds)):
+            return None
+        chunks = queue.Queue()
+        cancelled = threading.Event()
+        try:
+            self._executor.submit(self._pump, prompt, chunks, cancelled)
+        except Exception:
+            self._slots.release()
+            raise
+        return chunks, cancelled
+
+    # --- public API ---
+    def invoke(self, prompt, timeout=None):
+        """Return the completion for prompt or raise an LLMError.
+
+        The breaker sees one outcome per invoke, not one per attempt.
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        trial = self._allow()
+        settled = False
+        try:
+            attempt = 0
+            while True:
+                try:
+                    result = self._invoke_once(prompt, deadline)
+                    self.breaker.record_success()
+                    settled = True
+                    return result
+                except LLMBusy:
+                    # Local overload says nothing about the upstream
+                    raise
+                except LLMTimeout:
+                    self.breaker.record_failure()
+                    settled = True
+                    raise
+                except Exception as e:
+                    delay = self._backoff(attempt)
+                    # A half-open trial gets exactly one attempt
+                    if trial or attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+                        self.breaker.record_failure()
+                        settled = True
+                        raise LLMError(f"LLM request failed: {str(e)}") from e
+                    logger.warning(f"LLM request failed ({str(e)}), retrying in {delay:.2f}s")
+                    time.sleep(delay)
+                    attempt += 1
+        finally:
+            if trial and not settled:
+                self.breaker.release_trial()
+
+    def stream(self, prompt, timeout=None):
+        """Yield completion chunks for prompt.
+
+        The first chunk must arrive within the timeout and later chunks
+        within stream_idle_timeout of each other; the total duration is not
+        limited. The upstream is read on the executor, so these deadlines
+        cut the wait short even when the upstream hangs. Retries happen
+        only before the first chunk arrives; once text has been sent to the
+        caller the stream cannot be replayed.
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        trial = self._allow()
+        settled = False
+        try:
+            attempt = 0
+            while True:
+                started = time.monotonic()
+                opened = self._open_stream(prompt, deadline - started)
+                if opened is None:
+                    raise LLMBusy("Timed out waiting for an LLM slot")
+                chunks, cancelled = opened
+                received = False
+                try:
+                    while True:
+                        wait_for = self.stream_idle_timeout if received else deadline - time.monotonic()
+                        try:
+                            kind, value = chunks.get(timeout=max(0, wait_for))
+                        except queue.Empty:
+                            if received:
+                                raise LLMTimeout("LLM stream stalled between chunks")
+                            raise LLMTimeout("LLM stream produced no output before its deadline")
+                        if kind == 'end':
+                            break
+                        if kind == 'error':
+                            raise value
+                        if not received:
+                            received = True
+                            self._record_latency(time.monotonic() - started, self._first_chunk_latencies)
+                        yield value
+                    self.breaker.record_success()
+                    settled = True
+                    return
+                except GeneratorExit:
+                    # The caller went away; not an upstream outcome
+                    raise
+                except LLMTimeout:
+                    self.breaker.record_failure()
+                    settled = True
+                    raise
+                except Exception as e:
+                    delay = self._backoff(attempt)
+                    if received or trial or attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+                        self.breaker.record_failure()
+                        settled = True
+                        raise LLMError(f"LLM stream failed: {str(e)}") from e
+                    logger.warning(f"LLM stream failed ({str(e)}), retrying in {delay:.2f}s")
+                    time.sleep(delay)
+                    attempt += 1
+                finally:
+                    # Stops the reader at its next chunk
+                    cancelled.set()
+        finally:
+            if trial and not settled:
+                self.breaker.release_trial()
+
+    def stats(self):
+        return {
+            'backend': type(self.backend).__name__,
+            'circuit': self.breaker.state,
+            'p95_latency': self.p95_latency(),
+            'samples': len(self._latencies),
+            'p95_first_chunk_latency': self._p95(self._first_chunk_latencies),
+            'stream_samples': len(self._first_chunk_latencies)
+        }
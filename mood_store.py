@@ -0,0 +1,119 @@
+"""Mood log with incrementally maintained rollups.
+
+Every recorded mood is stored in `mood_entries` and folded into one
+rollup document per day, ISO week and month in `mood_rollups`:
+
+    {'user_id': ..., 'period': 'week', 'start': <Monday 00:00 UTC>,
+     'count': 12, 'sum': 41, 'min': 1, 'max': 5}
+
+with a single upsert each. Trend charts read those buckets directly, so
+their cost depends on the number of buckets shown, not on how many moods
+a user has logged.
+"""
+from datetime import datetime, timedelta
+import logging
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# Scores run from 1 (worst) to 5 (best); labels come from the dashboard
+# mood cards and the diary mood picker
+MOOD_SCORES = {
+    'happy': 5,
+    'excited': 5,
+    'calm': 4,
+    'neutral': 3,
+    'tired': 2,
+    'sad': 1,
+    'angry': 1,
+}
+MIN_SCORE = 1
+MAX_SCORE = 5
+PERIODS = ('day', 'week', 'month')
+
+
+def mood_score(mood):
+    """Return the numeric score for a label or number; raises ValueError."""
+    if isinstance(mood, bool):
+        raise ValueError("Mood must be a label or a number")
+    if isinstance(mood, (int, float)):
+        score = mood
+    elif isinstance(mood, str) and mood.lower() in MOOD_SCORES:
+        return MOOD_SCORES[mood.lower()]
+    else:
+        raise ValueError(f"Unknown mood {mood!r}, expected one of {sorted(MOOD_SCORES)} or a number")
+    if not MIN_SCORE <= score <= MAX_SCORE:
+        raise ValueError(f"Mood score must be between {MIN_SCORE} and {MAX_SCORE}")
+    return score
+
+
+def period_start(period, moment):
+    day = datetime(moment.year, moment.month, moment.day)
+    if period == 'day':
+        return day
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    raise ValueError(f"Unknown period '{period}', expected one of {PERIODS}")
+
+
+class MoodStore:
+    def __init__(self, entries, rollups):
+        self.entries = entries
+        self.rollups = rollups
+
+    def record(self, user_id, mood, note=None, source='dashboard', recorded_at=None):
+        """Store a mood and fold it into its rollup buckets.
+
+        Returns the inserted entry. Raises ValueError for unknown moods.
+        """
+        score = mood_score(mood)
+        recorded_at = recorded_at or datetime.utcnow()
+        entry = {
+            'user_id': user_id,
+            'mood': mood if isinstance(mood, str) else None,
+            'score': score,
+            'note': note,
+            'source': source,
+            'created_at': recorded_at
+        }
+        entry['_id'] = self.entries.insert_one(entry).inserted_id
+        self.rollups.bulk_write([
+            UpdateOne(
+                {'user_id': user_id, 'period': period, 'start': period_start(period, recorded_at)},
+                {
+                    '$inc': {'count': 1, 'sum': score},
+                    '$min': {'min': score},
+                    '$max': {'max': score}
+                },
+                upsert=True
+            )
+            for period in PERIODS
+        ], ordered=False)
+        return entry
+
+    def latest(self, user_id):
+        return self.entries.find_one(
+            {'user_id': user_id},
+            {'user_id': 0},
+            sort=[('created_at', -1)]
+        )
+
+    def trend(self, user_id, period, start, end):
+        """Return the buckets of period whose start lies in [start, end]."""
+        if period not in PERIODS:
+            raise ValueError(f"Unknown period '{period}', expected one of {PERIODS}")
+        buckets = self.rollups.find(
+            {
+                'user_id': user_id,
+                'period': period,
+                'start': {'$gte': period_start(period, start), '$lte': end}
+            },
+            {'_id': 0, 'start': 1, 'count': 1, 'sum': 1, 'min': 1, 'max': 1}
+        ).sort('start', 1)
+        return [
+            dict(bucket, average=round(bucket['sum'] / bucket['count'], 2))
+            for bucket in buckets
+        ]
@@ -0,0 +1,198 @@
+"""Token-budgeted prompt construction for the chat endpoints.
+
+The prompt is made of the fixed system instructions, the current user
+message, a running summary of older turns and as many recent turns as fit
+in the remaining budget, newest first. The stored history window is sized
+by a token budget as well (see ChatHistoryStore), and turns that drop out
+of it are folded into the running summary by RollingSummarizer on a
+background thread, so summarization never adds latency to a reply and
+older context is either verbatim in the prompt or in the summary.
+"""
+from collections import OrderedDict
+from datetime import datetime
+import logging
+import math
+import os
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = (
+    "You are a highly experienced, warm, and friendly AI Psychiatrist. "
+    "Please answer the user with empathy and offer supportive guidance based on their concerns. "
+    "Please provide the answer not too long and not too short like it should be like a conversation. "
+    "Please provide the answer in a way that is easy to understand and not too technical, not too formal and not too informal."
+)
+
+SUMMARY_PROMPT = (
+    "You maintain a short running summary of a supportive conversation between a user and an AI Psychiatrist. "
+    "Update the summary with the new exchanges below. Keep the facts, feelings and concerns the user shared "
+    "and any advice already given. Reply with the updated summary only, in at most {max_words} words.\n\n"
+    "Current summary:\n{summary}\n\n"
+    "New exchanges:\n{turns}"
+)
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+_encoding = None  # None until first use, False if unavailable
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    # Loaded on first use rather than at import: the first get_encoding()
+    # call downloads the BPE file
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    _encoding = tiktoken.get_encoding("cl100k_base") if tiktoken else False
+                except Exception as e:
+                    logger.warning(f"Could not load the tiktoken encoding, estimating token counts instead: {str(e)}")
+                    _encoding = False
+    return _encoding
+
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text))
+    # Roughly four characters per token for English text
+    return math.ceil(len(text) / 4)
+
+
+def format_turn(entry):
+    return f"User: {entry['user']}\nAI: {entry['ai']}\n\n"
+
+
+def turn_tokens(entry):
+    return count_tokens(format_turn(entry))
+
+
+def build_prompt(user_input, history, summary=None, token_budget=1500):
+    """Return (prompt, token_count) for user_input within token_budget.
+
+    The system text and user message are always included. The summary and
+    recent turns are added only while they fit.
+    """
+    tail = f"Current user message: {user_input}\n\n{SYSTEM_PROMPT}"
+    remaining = token_budget - count_tokens(tail) - count_tokens("Previous conversation:\n\n")
+
+    summary_section = ""
+    if summary:
+        candidate = f"Summary of earlier conversation:\n{summary}\n\n"
+        cost = count_tokens(candidate)
+        if cost <= remaining:
+            summary_section = candidate
+            remaining -= cost
+
+    # Pack turns newest first and stop at the first one that does not fit,
+    # so the verbatim history stays contiguous
+    turns = []
+    for entry in reversed(history):
+        turn = format_turn(entry)
+        cost = count_tokens(turn)
+        if cost > remaining:
+            break
+        turns.append(turn)
+        remaining -= cost
+    conversation = "".join(reversed(turns))
+
+    prompt = f"{summary_section}Previous conversation:\n{conversation}\n{tail}"
+    return prompt, count_tokens(prompt)
+
+
+class RollingSummarizer:
+    """Folds turns evicted from the history window into a running summary.
+
+    Updates run on a single background worker so that updates for the same
+    session are applied in order. The job queue is bounded; when it is full,
+    or when the LLM call fails, the turns are kept in a small per-session
+    backlog and folded in by that session's next update instead of being
+    lost. Jobs queued before a session was cleared are skipped, and their
+    summary is never written back (see ChatHistoryStore.set_summary).
+    """
+
+    def __init__(self, history_store, invoke, max_words=150, max_queue=256,
+                 max_backlog_turns=20, max_backlog_sessions=1000):
+        self.history_store = history_store
+        self.invoke = invoke
+        self.max_words = max_words
+        self.max_backlog_turns = max_backlog_turns
+        self.max_backlog_sessions = max_backlog_sessions
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._backlog = OrderedDict()  # session id -> turns not summarized yet
+        self._cleared = OrderedDict()  # session id -> when it was last cleared
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            threading.Thread(target=self._run, name='summarizer', daemon=True).start()
+            self._pid = os.getpid()
+
+    def _defer(self, session_id, turns):
+        # Callers hold self._lock
+        backlog = self._backlog.pop(session_id, []) + list(turns)
+        if len(backlog) > self.max_backlog_turns:
+            logger.warning(f"Dropping {len(backlog) - self.max_backlog_turns} unsummarized turns for session {session_id}")
+            backlog = backlog[-self.max_backlog_turns:]
+        self._backlog[session_id] = backlog
+        while len(self._backlog) > self.max_backlog_sessions:
+            self._backlog.popitem(last=False)
+
+    def submit(self, session_id, evicted_turns):
+        if not evicted_turns:
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((session_id, list(evicted_turns), datetime.utcnow()))
+        except queue.Full:
+            logger.warning(f"Summary queue full, deferring turns for session {session_id}")
+            with self._lock:
+                self._defer(session_id, evicted_turns)
+
+    def forget(self, session_id):
+        """Drop pending work for a session whose history was cleared."""
+        with self._lock:
+            self._backlog.pop(session_id, None)
+            self._cleared[session_id] = datetime.utcnow()
+            # Only needed while jobs queued before the clear are pending
+            while len(self._cleared) > self.max_backlog_sessions:
+                self._cleared.popitem(last=False)
+
+    def _run(self):
+        while True:
+            session_id, turns, queued_at = self._queue.get()
+            self._update(session_id, turns, queued_at)
+
+    def _update(self, session_id, evicted_turns, queued_at):
+        with self._lock:
+            cleared_at = self._cleared.get(session_id)
+            if cleared_at is not None and cleared_at >= queued_at:
+                return
+            self._cleared.pop(session_id, None)
+            turns = self._backlog.pop(session_id, []) + evicted_turns
+        try:
+            summary = self.history_store.get_summary(session_id) or "(none yet)"
+            prompt = SUMMARY_PROMPT.format(
+                max_words=self.max_words,
+                summary=summary,
+                turns="".join(format_turn(entry) for entry in turns)
+            )
+            if self.history_store.set_summary(session_id, self.invoke(prompt).strip(), since=queued_at):
+                logger.debug(f"Updated conversation summary for session {session_id}")
+            else:
+                logger.debug(f"Session {session_id} was cleared, discarding its summary")
+        except Exception as e:
+            logger.error(f"Error updating conversation summary, will retry with the next update: {str(e)}")
+            with self._lock:
+                self._defer(session_id, turns)
@@ -1,27 +1,51 @@
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask import session
+from contextlib import contextmanager
+import logging
+import os
 import random
-import string
 import time
-from collections import defaultdict
 import json
 import base64
 
+from standup_state import create_state_backend
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+STATE_BACKEND = os.getenv('STANDUP_STATE_BACKEND', 'memory')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+ROOM_CAPACITY = int(os.getenv('STANDUP_ROOM_CAPACITY', '7'))
+# Matches the 7 minute countdown shown to the speaker
+SPEAKING_LIMIT_SECONDS = int(os.getenv('STANDUP_SPEAKING_LIMIT', '420'))
+BREAK_SECONDS = int(os.getenv('STANDUP_BREAK_SECONDS', '60'))
+
+# With shared state, every worker must also publish emits through the same
+# message queue so broadcasts reach clients connected to other workers.
+# Polling transports additionally need sticky sessions at the load balancer.
+SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE') or (REDIS_URL if STATE_BACKEND == 'redis' else None)
+
 # Initialize SocketIO
-socketio = SocketIO()
+socketio_options = {}
+if SOCKETIO_MESSAGE_QUEUE:
+    socketio_options['message_queue'] = SOCKETIO_MESSAGE_QUEUE
+socketio = SocketIO(**socketio_options)
 
-# Store room data
-rooms = defaultdict(lambda: {
-    'users': [],
-    'speaker_queue': [],
-    'current_speaker': None,
-    'speaking_start_time': None,
-    'break_end_time': None,
-    'is_break': False
-})
+# Rooms, users and turn deadlines. Socket.IO handlers can run concurrently
+# (and, with the redis backend, in other processes), so every
+# read-modify-write of a room happens under that room's lock. Emits happen
+# after it is released.
+state_options = {'capacity': ROOM_CAPACITY}
+if STATE_BACKEND == 'redis':
+    state_options['url'] = REDIS_URL
+state = create_state_backend(STATE_BACKEND, **state_options)
 
-# Store user data
-users = {}
+# Audio frames arrive many times a second, so who may broadcast is cached
+# per process: user id -> (room id, name) for speakers, False otherwise.
+# Turn changes made by this process drop the entry; other processes' changes
+# show up within SPEAKER_CACHE_SECONDS.
+SPEAKER_CACHE_SECONDS = float(os.getenv('STANDUP_SPEAKER_CACHE_SECONDS', '1'))
+speaker_cache = TTLCache(10000)
 
 def generate_random_name():
     adjectives = ['Happy', 'Brave', 'Clever', 'Gentle', 'Kind', 'Wise', 'Calm', 'Bright', 'Swift', 'Noble']
@@ -29,23 +53,142 @@ def generate_random_name():
     number = random.randint(1, 999)
     return f"{random.choice(adjectives)} {random.choice(animals)} #{number}"
 
-def get_or_create_room():
-    # Find a room with less than 7 users or create a new one
-    for room_id, room_data in rooms.items():
-        if len(room_data['users']) < 7:
-            return room_id
-    
-    # Create new room if all rooms are full
-    new_room_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-    rooms[new_room_id] = {
-        'users': [],
-        'speaker_queue': [],
-        'current_speaker': None,
-        'speaking_start_time': None,
-        'break_end_time': None,
-        'is_break': False
+def room_update_payload(room):
+    return {
+        'total_users': len(room['users']),
+        'current_speaker': room['current_speaker'],
+        'speaker_queue': state.user_names(room['speaker_queue'])
+    }
+
+def user_name(user_id):
+    user = state.get_user(user_id)
+    return user['name'] if user else None
+
+# Turn transitions; callers hold the room's lock, save the room afterwards
+# and emit the returned payloads
+
+def begin_turn(room_id, room, user_id):
+    speaker_cache.pop(user_id)
+    room['current_speaker'] = user_id
+    room['speaking_start_time'] = time.time()
+    room['is_break'] = False
+    room['break_end_time'] = None
+    room['turn_id'] += 1
+    scheduler.schedule(room['speaking_start_time'] + SPEAKING_LIMIT_SECONDS, room_id, 'speaking_limit', room['turn_id'])
+    return {
+        'speaker': user_name(user_id),
+        'start_time': room['speaking_start_time'],
+        'time_limit': SPEAKING_LIMIT_SECONDS
     }
-    return new_room_id
+
+def start_break(room_id, room):
+    if room['current_speaker']:
+        speaker_cache.pop(room['current_speaker'])
+    room['current_speaker'] = None
+    room['speaking_start_time'] = None
+    room['is_break'] = True
+    room['break_end_time'] = time.time() + BREAK_SECONDS
+    room['turn_id'] += 1
+    scheduler.schedule(room['break_end_time'], room_id, 'break_end', room['turn_id'])
+    next_speaker = room['speaker_queue'].first()
+    return {
+        'next_speaker': user_name(next_speaker) if next_speaker else None,
+        'break_end_time': room['break_end_time']
+    }
+
+def promote_next_speaker(room_id, room):
+    # Give the floor to the head of the queue if the room is idle
+    if room['current_speaker'] or room['is_break']:
+        return None
+    next_speaker = room['speaker_queue'].first()
+    if next_speaker is None:
+        return None
+    return begin_turn(room_id, room, next_speaker)
+
+def on_deadline(room_id, kind, turn_id):
+    events = []
+    with state.room_lock(room_id):
+        room = state.get_room(room_id)
+        if room is None or room['turn_id'] != turn_id:
+            return
+        
+        if kind == 'speaking_limit':
+            # The speaker ran out of time
+            room['speaker_queue'].remove(room['current_speaker'])
+            events.append(('speaking_ended', dict(start_break(room_id, room), reason='time_limit')))
+        elif kind == 'break_end':
+            room['is_break'] = False
+            room['break_end_time'] = None
+            room['turn_id'] += 1
+            status = promote_next_speaker(room_id, room)
+            if status:
+                events.append(('speaking_status', status))
+        state.save_room(room_id, room)
+        events.append(('room_update', room_update_payload(room)))
+    
+    for event, payload in events:
+        socketio.emit(event, payload, to=room_id)
+
+def remove_from_room(user_id, room_id, room):
+    # Returns the room, or None if it was deleted because it is now empty;
+    # callers hold the room's lock
+    room['speaker_queue'].remove(user_id)
+    
+    # If user was speaking, end their turn
+    if room['current_speaker'] == user_id:
+        start_break(room_id, room)
+    
+    # Remove user from room; empty rooms are deleted
+    return state.leave(user_id, room_id, room)
+
+def remove_departed_users():
+    # Users whose worker died never ran their disconnect handler; their
+    # user keys expire and this sweep takes them out of their rooms
+    for room_id in state.room_ids():
+        update = None
+        with state.room_lock(room_id):
+            room = state.get_room(room_id)
+            if room is None:
+                continue
+            departed = state.departed_users(room)
+            if not departed:
+                continue
+            for user_id in departed:
+                logger.info(f"Removing departed user {user_id} from room {room_id}")
+                room = remove_from_room(user_id, room_id, room)
+                if room is None:
+                    break
+            if room:
+                update = room_update_payload(room)
+        
+        if update:
+            socketio.emit('room_update', update, to=room_id)
+
+scheduler = state.create_scheduler(on_deadline, sweep=remove_departed_users)
+
+@contextmanager
+def locked_room(user_id):
+    # (room_id, room) for a connected user with that room locked, or (None, None)
+    user = state.get_user(user_id) if user_id else None
+    if not user or not user['room']:
+        yield None, None
+        return
+    with state.room_lock(user['room']):
+        room = state.get_room(user['room'])
+        yield (user['room'], room) if room else (None, None)
+
+def speaker_info(user_id):
+    # (room_id, name) if user_id holds the floor, else False; see speaker_cache
+    info = speaker_cache.get(user_id)
+    if info is None:
+        info = False
+        user = state.get_user(user_id) if user_id else None
+        if user and user['room']:
+            room = state.get_room(user['room'])
+            if room and room['current_speaker'] == user_id:
+                info = (user['room'], user['name'])
+        speaker_cache.set(user_id, info, time.time() + SPEAKER_CACHE_SECONDS)
+    return info
 
 @socketio.on('connect')
 def handle_connect():
@@ -53,18 +196,24 @@ def handle_connect():
     if not user_id:
         return False
     
+    # Every worker polls for due deadlines, whichever one scheduled them
+    scheduler.start()
+    
     # Generate random name for the user
     random_name = generate_random_name()
-    users[user_id] = {
+    
+    # Assign user to a room
+    user = {
         'name': random_name,
         'room': None,
         'is_muted': False
     }
-    
-    # Assign user to a room
-    room_id = get_or_create_room()
-    users[user_id]['room'] = room_id
-    rooms[room_id]['users'].append(user_id)
+    state.save_user(user_id, user)
+    room_id = state.join(user_id)
+    user['room'] = room_id
+    state.save_user(user_id, user)
+    with state.room_lock(room_id):
+        update = room_update_payload(state.get_room(room_id))
     
     # Join the room
     join_room(room_id)
@@ -74,181 +223,150 @@ def handle_connect():
         'room_id': room_id,
         'user_name': random_name,
         'queue_position': None,
-        'total_users': len(rooms[room_id]['users'])
+        'total_users': update['total_users']
     })
     
     # Broadcast updated room info to all users in the room
-    emit('room_update', {
-        'total_users': len(rooms[room_id]['users']),
-        'current_speaker': rooms[room_id]['current_speaker'],
-        'speaker_queue': [users[uid]['name'] for uid in rooms[room_id]['speaker_queue']]
-    }, room=room_id)
+    emit('room_update', update, room=room_id)
 
 @socketio.on('disconnect')
 def handle_disconnect():
     user_id = session.get('user_id')
-    if not user_id or user_id not in users:
+    
+    if not user_id or state.get_user(user_id) is None:
         return
     
-    room_id = users[user_id]['room']
+    update = None
+    with locked_room(user_id) as (room_id, room):
+        if room:
+            # Remove user from the speaker queue and the room
+            room = remove_from_room(user_id, room_id, room)
+            if room:
+                update = room_update_payload(room)
+    
+    # Remove user data
+    state.delete_user(user_id)
+    speaker_cache.pop(user_id)
+    
     if room_id:
-        # Remove user from room
-        if user_id in rooms[room_id]['users']:
-            rooms[room_id]['users'].remove(user_id)
-        
-        # Remove user from speaker queue
-        if user_id in rooms[room_id]['speaker_queue']:
-            rooms[room_id]['speaker_queue'].remove(user_id)
-        
-        # If user was speaking, end their turn
-        if rooms[room_id]['current_speaker'] == user_id:
-            rooms[room_id]['current_speaker'] = None
-            rooms[room_id]['speaking_start_time'] = None
-            rooms[room_id]['is_break'] = True
-            rooms[room_id]['break_end_time'] = time.time() + 60
-        
         # Leave the room
         leave_room(room_id)
         
         # Broadcast updated room info
-        emit('room_update', {
-            'total_users': len(rooms[room_id]['users']),
-            'current_speaker': rooms[room_id]['current_speaker'],
-            'speaker_queue': [users[uid]['name'] for uid in rooms[room_id]['speaker_queue']]
-        }, room=room_id)
-        
-        # Clean up empty rooms
-        if len(rooms[room_id]['users']) == 0:
-            del rooms[room_id]
-    
-    # Remove user data
-    del users[user_id]
+        if update:
+            emit('room_update', update, room=room_id)
 
 @socketio.on('request_speak')
 def handle_speak_request():
     user_id = session.get('user_id')
-    if not user_id or user_id not in users:
-        return
-    
-    room_id = users[user_id]['room']
-    if not room_id or room_id not in rooms:
-        return
     
-    # Add user to speaker queue if not already in it
-    if user_id not in rooms[room_id]['speaker_queue']:
-        rooms[room_id]['speaker_queue'].append(user_id)
-        
-        # Emit updated queue position
-        emit('queue_update', {
-            'position': rooms[room_id]['speaker_queue'].index(user_id) + 1
-        })
+    with locked_room(user_id) as (room_id, room):
+        if not room:
+            return
         
-        # Broadcast updated queue to all users
-        emit('room_update', {
-            'total_users': len(rooms[room_id]['users']),
-            'current_speaker': rooms[room_id]['current_speaker'],
-            'speaker_queue': [users[uid]['name'] for uid in rooms[room_id]['speaker_queue']]
-        }, room=room_id)
+        # Add user to speaker queue if not already in it
+        position = room['speaker_queue'].append(user_id)
+        if position is None:
+            return
+        # Nobody is speaking, so the floor can be handed over right away
+        status = promote_next_speaker(room_id, room)
+        state.save_room(room_id, room)
+        update = room_update_payload(room)
+    
+    # Emit updated queue position
+    emit('queue_update', {
+        'position': position
+    })
+    
+    # Broadcast updated queue to all users
+    emit('room_update', update, room=room_id)
+    if status:
+        emit('speaking_status', status, room=room_id)
 
 @socketio.on('start_speaking')
 def handle_start_speaking():
     user_id = session.get('user_id')
-    if not user_id or user_id not in users:
-        return
-    
-    room_id = users[user_id]['room']
-    if not room_id or room_id not in rooms:
-        return
     
-    # Check if it's user's turn and not in break time
-    if (rooms[room_id]['speaker_queue'] and 
-        rooms[room_id]['speaker_queue'][0] == user_id and 
-        not rooms[room_id]['current_speaker'] and
-        not rooms[room_id]['is_break']):
+    with locked_room(user_id) as (room_id, room):
+        if not room:
+            return
         
-        rooms[room_id]['current_speaker'] = user_id
-        rooms[room_id]['speaking_start_time'] = time.time()
+        # Turns are normally granted by the scheduler; this only covers a
+        # queue head whose turn was not started yet
+        if not (room['speaker_queue'].first() == user_id and
+                not room['current_speaker'] and
+                not room['is_break']):
+            return
         
-        # Broadcast speaking status
-        emit('speaking_status', {
-            'speaker': users[user_id]['name'],
-            'start_time': rooms[room_id]['speaking_start_time']
-        }, room=room_id)
+        status = begin_turn(room_id, room, user_id)
+        state.save_room(room_id, room)
+    
+    # Broadcast speaking status
+    emit('speaking_status', status, room=room_id)
 
 @socketio.on('audio_stream')
 def handle_audio_stream(data):
     user_id = session.get('user_id')
-    if not user_id or user_id not in users:
-        return
     
-    room_id = users[user_id]['room']
-    if not room_id or room_id not in rooms:
+    # Hot path: a cached, lock-free check that the user is the current speaker
+    info = speaker_info(user_id)
+    if not info:
         return
+    room_id, speaker = info
     
-    # Check if user is the current speaker
-    if rooms[room_id]['current_speaker'] == user_id:
-        # Broadcast audio to all users in the room except the sender
-        emit('audio_stream', {
-            'audio': data['audio'],
-            'speaker': users[user_id]['name']
-        }, room=room_id, include_self=False)
+    # Broadcast audio to all users in the room except the sender
+    emit('audio_stream', {
+        'audio': data['audio'],
+        'speaker': speaker
+    }, room=room_id, include_self=False)
 
 @socketio.on('end_speaking')
 def handle_end_speaking():
     user_id = session.get('user_id')
-    if not user_id or user_id not in users:
-        return
-    
-    room_id = users[user_id]['room']
-    if not room_id or room_id not in rooms:
-        return
     
-    # Check if user is the current speaker
-    if rooms[room_id]['current_speaker'] == user_id:
-        # Remove user from queue
-        if user_id in rooms[room_id]['speaker_queue']:
-            rooms[room_id]['speaker_queue'].remove(user_id)
-        
-        # Clear current speaker
-        rooms[room_id]['current_speaker'] = None
-        rooms[room_id]['speaking_start_time'] = None
+    with locked_room(user_id) as (room_id, room):
+        # Check if user is the current speaker
+        if not room or room['current_speaker'] != user_id:
+            return
         
-        # Set break time
-        rooms[room_id]['is_break'] = True
-        rooms[room_id]['break_end_time'] = time.time() + 60
+        # Remove user from queue
+        room['speaker_queue'].remove(user_id)
         
-        # Broadcast speaking end
-        emit('speaking_ended', {
-            'next_speaker': users[rooms[room_id]['speaker_queue'][0]]['name'] if rooms[room_id]['speaker_queue'] else None,
-            'break_end_time': rooms[room_id]['break_end_time']
-        }, room=room_id)
+        # Clear current speaker and start the break; the scheduler ends it
+        ended = start_break(room_id, room)
+        state.save_room(room_id, room)
+    
+    # Broadcast speaking end
+    emit('speaking_ended', ended, room=room_id)
 
 @socketio.on('send_reaction')
 def handle_reaction(data):
     user_id = session.get('user_id')
-    if not user_id or user_id not in users:
-        return
     
-    room_id = users[user_id]['room']
-    if not room_id or room_id not in rooms:
+    user = state.get_user(user_id) if user_id else None
+    if not user or not user['room']:
         return
     
     # Broadcast reaction to all users in the room
     emit('reaction', {
-        'user': users[user_id]['name'],
+        'user': user['name'],
         'reaction': data['reaction']
-    }, room=room_id)
+    }, room=user['room'])
 
 @socketio.on('toggle_mute')
 def handle_toggle_mute():
     user_id = session.get('user_id')
-    if not user_id or user_id not in users:
-        return
     
-    users[user_id]['is_muted'] = not users[user_id]['is_muted']
+    with locked_room(user_id):
+        user = state.get_user(user_id) if user_id else None
+        if not user:
+            return
+        user['is_muted'] = not user['is_muted']
+        state.save_user(user_id, user)
+    
     emit('mute_status', {
-        'is_muted': users[user_id]['is_muted']
+        'is_muted': user['is_muted']
     })
 
 def init_app(app):
-    socketio.init_app(app) 
\ No newline at end of file
+    socketio.init_app(app)
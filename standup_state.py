@@ -0,0 +1,543 @@
+"""Room, user and scheduling state for the stand-up server.
+
+The Socket.IO handlers read and write state only through a backend:
+
+    with state.room_lock(room_id):
+        room = state.get_room(room_id)
+        ...mutate room...
+        state.save_room(room_id, room)
+
+Mutations of a room happen under that room's lock. join() picks and
+updates a room itself, under a separate allocation lock taken before the
+room lock, so rooms never wait on each other except while users are
+being placed.
+
+'memory' keeps everything in this process and is only correct with a
+single Socket.IO worker. 'redis' keeps rooms, users, the open-room index
+and turn deadlines in Redis, so any number of workers or nodes share one
+view. It needs the `redis` package, and the workers must also share a
+Socket.IO message queue (see standup_server) so that emits to a room reach
+clients connected to other workers. Pick one with STANDUP_STATE_BACKEND.
+"""
+from collections import OrderedDict
+import heapq
+import json
+import logging
+import os
+import random
+import string
+import threading
+import time
+import uuid
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+class SpeakerQueue:
+    """FIFO of user ids with constant-time membership and removal."""
+
+    def __init__(self, user_ids=()):
+        self._entries = OrderedDict.fromkeys(user_ids)
+
+    def append(self, user_id):
+        """Queue user_id and return its 1-based position, or None if already queued."""
+        if user_id in self._entries:
+            return None
+        self._entries[user_id] = None
+        return len(self._entries)
+
+    def remove(self, user_id):
+        """Remove user_id if queued; returns whether it was."""
+        return self._entries.pop(user_id, False) is not False
+
+    def first(self):
+        return next(iter(self._entries), None)
+
+    def __contains__(self, user_id):
+        return user_id in self._entries
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def new_room():
+    return {
+        'users': [],
+        'speaker_queue': SpeakerQueue(),
+        'current_speaker': None,
+        'speaking_start_time': None,
+        'break_end_time': None,
+        'is_break': False,
+        # Bumped on every turn change so stale scheduler deadlines are ignored
+        'turn_id': 0
+    }
+
+
+def generate_room_id():
+    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+
+
+class RoomAllocator:
+    """Assigns users to stand-up rooms without scanning them.
+
+    Rooms that still have space are kept in buckets keyed by occupancy, so
+    finding one means checking at most `capacity` buckets no matter how
+    many rooms exist. The fullest non-full room is preferred, which keeps
+    rooms lively and lets empty ones be removed. Rooms are created and
+    deleted explicitly; looking up a missing room returns None.
+
+    Not thread-safe on its own; callers hold the backend's lock.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.rooms = {}
+        # occupancy -> ids of rooms with that many users, for 0 < occupancy < capacity
+        self._open_rooms = {}
+
+    def _bucket_remove(self, room_id, occupancy):
+        bucket = self._open_rooms.get(occupancy)
+        if bucket is not None:
+            bucket.discard(room_id)
+            if not bucket:
+                del self._open_rooms[occupancy]
+
+    def _bucket_add(self, room_id, occupancy):
+        if 0 < occupancy < self.capacity:
+            self._open_rooms.setdefault(occupancy, set()).add(room_id)
+
+    def _generate_room_id(self):
+        while True:
+            room_id = generate_room_id()
+            if room_id not in self.rooms:
+                return room_id
+
+    def _find_open_room(self):
+        for occupancy in range(self.capacity - 1, 0, -1):
+            bucket = self._open_rooms.get(occupancy)
+            if bucket:
+                return next(iter(bucket))
+        return None
+
+    def get(self, room_id):
+        return self.rooms.get(room_id)
+
+    def join(self, user_id):
+        """Add user_id to a room with space, creating one if needed; returns its id."""
+        room_id = self._find_open_room()
+        if room_id is None:
+            room_id = self._generate_room_id()
+            self.rooms[room_id] = new_room()
+        room = self.rooms[room_id]
+        self._bucket_remove(room_id, len(room['users']))
+        room['users'].append(user_id)
+        self._bucket_add(room_id, len(room['users']))
+        return room_id
+
+    def leave(self, user_id, room_id):
+        """Remove user_id from room_id. Returns the room, or None if it was removed."""
+        room = self.rooms.get(room_id)
+        if room is None:
+            return None
+        if user_id in room['users']:
+            self._bucket_remove(room_id, len(room['users']))
+            room['users'].remove(user_id)
+            self._bucket_add(room_id, len(room['users']))
+        # Clean up empty rooms
+        if not room['users']:
+            del self.rooms[room_id]
+            return None
+        return room
+
+
+class TurnScheduler:
+    """One background thread that fires room deadlines.
+
+    Deadlines for every room live in a single heap of
+    (due_at, seq, room_id, kind, turn_id). Nothing is ever cancelled: the
+    callback compares turn_id with the room's current one and ignores
+    deadlines that a later turn change has made stale. The thread is
+    started on the first schedule() or start() call.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self._heap = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='standup-scheduler', daemon=True)
+                self._thread.start()
+
+    def schedule(self, due_at, room_id, kind, turn_id):
+        self.start()
+        with self._cond:
+            self._seq += 1
+            heapq.heappush(self._heap, (due_at, self._seq, room_id, kind, turn_id))
+            # Wake the thread in case this deadline is now the earliest
+            self._cond.notify()
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap)
+
+    def _next_due(self):
+        with self._cond:
+            while True:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                delay = self._heap[0][0] - time.time()
+                if delay <= 0:
+                    return heapq.heappop(self._heap)
+                self._cond.wait(delay)
+
+    def _run(self):
+        while True:
+            _, _, room_id, kind, turn_id = self._next_due()
+            try:
+                self.callback(room_id, kind, turn_id)
+            except Exception as e:
+                logger.error(f"Stand-up {kind} deadline for room {room_id} failed: {str(e)}")
+
+
+class MemoryStateBackend:
+    """Process-local state; correct only with a single Socket.IO worker."""
+
+    def __init__(self, capacity):
+        self.allocator = RoomAllocator(capacity)
+        self.users = {}
+        self._lock = threading.RLock()
+
+    def room_lock(self, room_id):
+        # One process, so one lock for every room is enough
+        return self._lock
+
+    def create_scheduler(self, callback, sweep=None):
+        # No sweep needed: if this process dies its users go with it
+        return TurnScheduler(callback)
+
+    def get_user(self, user_id):
+        return self.users.get(user_id)
+
+    def save_user(self, user_id, user):
+        self.users[user_id] = user
+
+    def delete_user(self, user_id):
+        self.users.pop(user_id, None)
+
+    def user_names(self, user_ids):
+        return [self.users[uid]['name'] for uid in user_ids if uid in self.users]
+
+    def get_room(self, room_id):
+        return self.allocator.get(room_id)
+
+    def save_room(self, room_id, room):
+        # Rooms are mutated in place
+        pass
+
+    def join(self, user_id):
+        with self._lock:
+            return self.allocator.join(user_id)
+
+    def leave(self, user_id, room_id, room):
+        return self.allocator.leave(user_id, room_id)
+
+    def room_count(self):
+        return len(self.allocator.rooms)
+
+    def room_ids(self):
+        return list(self.allocator.rooms)
+
+    def departed_users(self, room):
+        return [uid for uid in room['users'] if uid not in self.users]
+
+
+class RedisTurnScheduler:
+    """Turn deadlines kept in a Redis sorted set scored by due time.
+
+    Every worker runs a polling thread, but only the one holding the
+    leader lease reads due deadlines, and each deadline is claimed with
+    ZREM so it fires exactly once even if two workers briefly both believe
+    they lead. Deadlines survive the worker that scheduled them.
+
+    The leader also calls sweep(), if given, every sweep_interval seconds.
+    """
+
+    def __init__(self, client, callback, prefix, poll_interval=0.5, lease_seconds=5,
+                 sweep=None, sweep_interval=30):
+        self.client = client
+        self.callback = callback
+        self.sweep = sweep
+        self.sweep_interval = sweep_interval
+        self._last_sweep = 0
+        self.key = f"{prefix}:deadlines"
+        self.leader_key = f"{prefix}:scheduler_leader"
+        self.poll_interval = poll_interval
+        self.lease_ms = int(lease_seconds * 1000)
+        self.token = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='standup-scheduler', daemon=True)
+                self._thread.start()
+
+    def schedule(self, due_at, room_id, kind, turn_id):
+        self.start()
+        self.client.zadd(self.key, {json.dumps([room_id, kind, turn_id]): due_at})
+
+    def pending(self):
+        return self.client.zcard(self.key)
+
+    def _is_leader(self):
+        if self.client.set(self.leader_key, self.token, nx=True, px=self.lease_ms):
+            return True
+        if self.client.get(self.leader_key) == self.token:
+            self.client.pexpire(self.leader_key, self.lease_ms)
+            return True
+        return False
+
+    def _fire_due(self):
+        for member in self.client.zrangebyscore(self.key, 0, time.time()):
+            # Whoever removes the member owns the deadline
+            if not self.client.zrem(self.key, member):
+                continue
+            room_id, kind, turn_id = json.loads(member)
+            try:
+                self.callback(room_id, kind, turn_id)
+            except Exception as e:
+                logger.error(f"Stand-up {kind} deadline for room {room_id} failed: {str(e)}")
+
+    def _run(self):
+        while True:
+            try:
+                if self._is_leader():
+                    self._fire_due()
+                    if self.sweep and time.time() - self._last_sweep >= self.sweep_interval:
+                        self._last_sweep = time.time()
+                        self.sweep()
+            except Exception as e:
+                logger.error(f"Stand-up scheduler error: {str(e)}")
+            time.sleep(self.poll_interval)
+
+
+class RedisStateBackend:
+    """State shared by every worker through Redis.
+
+    Keys, all under `prefix`:
+      room:<id>   JSON room document
+      user:<id>   JSON user document
+      open_rooms  sorted set of rooms with space, scored by occupancy
+      lock:room:<id>  mutex held around every read-modify-write of a room
+      lock:alloc  mutex held while join() places a user in a room
+      deadlines   turn deadlines, see RedisTurnScheduler
+
+    User and room keys expire after key_ttl seconds. Each process refreshes
+    the keys of the users connected to it (and of their rooms) from a
+    heartbeat thread, so the keys of a process that dies without running
+    its disconnect handlers run out. departed_users() then reports those
+    users, and the scheduler's sweep removes them from their rooms.
+
+    Turn changes and leaves in different rooms proceed in parallel. Only
+    joins are serialized cluster-wide, by lock:alloc, which is held for
+    the few round trips it takes to pick a room from open_rooms. The lock
+    order is always lock:alloc, then a room lock. Leaves update open_rooms
+    under the room lock alone, so join() re-checks the room it picked.
+    """
+
+    def __init__(self, capacity, url='redis://localhost:6379/0', prefix='standup',
+                 lock_timeout=5, key_ttl=90, client=None):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("The redis stand-up backend requires the 'redis' package")
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.capacity = capacity
+        self.prefix = prefix
+        self.lock_timeout = lock_timeout
+        self.key_ttl = key_ttl
+        self._open_key = f"{prefix}:open_rooms"
+        # user id -> room id for the users connected to this process
+        self._local_users = {}
+        self._local_lock = threading.Lock()
+        self._heartbeat_pid = None
+
+    def _room_key(self, room_id):
+        return f"{self.prefix}:room:{room_id}"
+
+    def _user_key(self, user_id):
+        return f"{self.prefix}:user:{user_id}"
+
+    def _lock(self, name):
+        return self.client.lock(
+            f"{self.prefix}:lock:{name}",
+            timeout=self.lock_timeout,
+            blocking_timeout=self.lock_timeout
+        )
+
+    def room_lock(self, room_id):
+        return self._lock(f"room:{room_id}")
+
+    def create_scheduler(self, callback, sweep=None):
+        return RedisTurnScheduler(self.client, callback, self.prefix, sweep=sweep)
+
+    def _ensure_heartbeat(self):
+        if self._heartbeat_pid == os.getpid():
+            return
+        with self._local_lock:
+            if self._heartbeat_pid == os.getpid():
+                return
+            threading.Thread(target=self._heartbeat_loop, name='standup-heartbeat', daemon=True).start()
+            self._heartbeat_pid = os.getpid()
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(self.key_ttl / 3)
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.error(f"Stand-up heartbeat failed: {str(e)}")
+
+    def heartbeat(self):
+        """Refresh the TTLs of this process's users and their rooms."""
+        with self._local_lock:
+            local_users = dict(self._local_users)
+        if not local_users:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for user_id, room_id in local_users.items():
+            pipe.expire(self._user_key(user_id), self.key_ttl)
+            if room_id:
+                pipe.expire(self._room_key(room_id), self.key_ttl)
+        pipe.execute()
+
+    def get_user(self, user_id):
+        data = self.client.get(self._user_key(user_id))
+        return json.loads(data) if data else None
+
+    def save_user(self, user_id, user):
+        # Users are saved by the process their socket is connected to
+        self.client.set(self._user_key(user_id), json.dumps(user), ex=self.key_ttl)
+        with self._local_lock:
+            self._local_users[user_id] = user.get('room')
+        self._ensure_heartbeat()
+
+    def delete_user(self, user_id):
+        self.client.delete(self._user_key(user_id))
+        with self._local_lock:
+            self._local_users.pop(user_id, None)
+
+    def user_names(self, user_ids):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return []
+        values = self.client.mget([self._user_key(uid) for uid in user_ids])
+        return [json.loads(value)['name'] for value in values if value]
+
+    def get_room(self, room_id):
+        data = self.client.get(self._room_key(room_id))
+        if not data:
+            return None
+        room = json.loads(data)
+        room['speaker_queue'] = SpeakerQueue(room['speaker_queue'])
+        return room
+
+    def save_room(self, room_id, room):
+        self.client.set(
+            self._room_key(room_id),
+            json.dumps(dict(room, speaker_queue=list(room['speaker_queue']))),
+            ex=self.key_ttl
+        )
+
+    def _update_open_rooms(self, room_id, occupancy):
+        if 0 < occupancy < self.capacity:
+            self.client.zadd(self._open_key, {room_id: occupancy})
+        else:
+            self.client.zrem(self._open_key, room_id)
+
+    def join(self, user_id):
+        """Add user_id to the fullest room with space, or a new one; returns the room id."""
+        with self._lock('alloc'):
+            while True:
+                open_rooms = self.client.zrevrangebyscore(self._open_key, self.capacity - 1, 1, start=0, num=1)
+                if not open_rooms:
+                    break
+                room_id = open_rooms[0]
+                with self.room_lock(room_id):
+                    room = self.get_room(room_id)
+                    if room is None:
+                        # The room key expired; drop its stale index entry
+                        self.client.zrem(self._open_key, room_id)
+                        continue
+                    if len(room['users']) >= self.capacity:
+                        # Filled up since the index was read
+                        self._update_open_rooms(room_id, len(room['users']))
+                        continue
+                    room['users'].append(user_id)
+                    self.save_room(room_id, room)
+                    self._update_open_rooms(room_id, len(room['users']))
+                    return room_id
+
+            room_id = generate_room_id()
+            while self.client.exists(self._room_key(room_id)):
+                room_id = generate_room_id()
+            room = new_room()
+            room['users'].append(user_id)
+            self.save_room(room_id, room)
+            self._update_open_rooms(room_id, len(room['users']))
+            return room_id
+
+    def leave(self, user_id, room_id, room):
+        if user_id in room['users']:
+            room['users'].remove(user_id)
+        # Clean up empty rooms
+        if not room['users']:
+            self.client.delete(self._room_key(room_id))
+            self.client.zrem(self._open_key, room_id)
+            return None
+        self.save_room(room_id, room)
+        self._update_open_rooms(room_id, len(room['users']))
+        return room
+
+    def room_count(self):
+        return sum(1 for _ in self.client.scan_iter(f"{self.prefix}:room:*"))
+
+    def room_ids(self):
+        prefix = f"{self.prefix}:room:"
+        return [key[len(prefix):] for key in self.client.scan_iter(f"{prefix}*")]
+
+    def departed_users(self, room):
+        """Users listed in room whose user key has expired."""
+        user_ids = list(room['users'])
+        if not user_ids:
+            return []
+        values = self.client.mget([self._user_key(uid) for uid in user_ids])
+        return [uid for uid, value in zip(user_ids, values) if value is None]
+
+
+STATE_BACKENDS = {
+    'memory': MemoryStateBackend,
+    'redis': RedisStateBackend,
+}
+
+
+def create_state_backend(name, **kwargs):
+    try:
+        return STATE_BACKENDS[name](**kwargs)
+    except KeyError:
+        raise ValueError(f"Unknown stand-up state backend '{name}', expected one of {sorted(STATE_BACKENDS)}")
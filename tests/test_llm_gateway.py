@@ -0,0 +1,127 @@
+import threading
+import time
+import unittest
+
+from llm_gateway import (
+    CircuitBreaker,
+    CircuitOpenError,
+    LLMBusy,
+    LLMGateway,
+    LLMTimeout,
+    StubBackend,
+)
+
+
+class PacedBackend(StubBackend):
+    """Stub that waits before each streamed word.
+
+    gap is either one delay for every word or a list with one per word.
+    """
+
+    def __init__(self, words, gap):
+        super().__init__(reply=" ".join(words))
+        self.gaps = gap if isinstance(gap, list) else [gap] * len(words)
+
+    def stream(self, prompt):
+        for word, gap in zip(self.reply.split(" "), self.gaps):
+            time.sleep(gap)
+            yield word + " "
+
+
+def half_open_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    breaker.opened_at -= breaker.reset_timeout
+    return breaker
+
+
+class CircuitBreakerTrialTest(unittest.TestCase):
+    def test_trial_stream_closed_early_releases_trial(self):
+        gateway = LLMGateway(StubBackend(reply="one two three"), breaker=half_open_breaker())
+        upstream = gateway.stream("hello")
+        next(upstream)
+        upstream.close()
+
+        self.assertEqual(gateway.breaker.state, 'half-open')
+        self.assertEqual(gateway.invoke("hello"), "one two three")
+        self.assertEqual(gateway.breaker.state, 'closed')
+
+    def test_trial_without_slot_releases_trial(self):
+        gateway = LLMGateway(StubBackend(latency=0.3), max_concurrency=1, timeout=1)
+        busy = threading.Thread(target=gateway.invoke, args=("hello",))
+        busy.start()
+        time.sleep(0.05)
+        gateway.breaker = half_open_breaker()
+
+        with self.assertRaises(LLMBusy):
+            gateway.invoke("hello", timeout=0.05)
+        self.assertEqual(gateway.breaker.allow(), 'trial')
+        busy.join()
+
+    def test_stalled_stream_counts_as_failure(self):
+        gateway = LLMGateway(
+            PacedBackend(["a", "b"], gap=[0, 2]),
+            stream_idle_timeout=0.1,
+            breaker=half_open_breaker()
+        )
+        received = []
+        started = time.monotonic()
+        with self.assertRaises(LLMTimeout):
+            for chunk in gateway.stream("hello"):
+                received.append(chunk)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(received, ["a "])
+        self.assertEqual(gateway.breaker.state, 'open')
+        with self.assertRaises(CircuitOpenError):
+            gateway.invoke("hello")
+
+
+class DeadlineTest(unittest.TestCase):
+    def test_long_stream_is_not_cut_off(self):
+        words = ["w%d" % i for i in range(6)]
+        gateway = LLMGateway(PacedBackend(words, gap=0.05), timeout=0.15, stream_idle_timeout=0.15)
+        self.assertEqual("".join(gateway.stream("hello")).split(), words)
+
+    def test_first_chunk_deadline_cuts_off_the_wait(self):
+        gateway = LLMGateway(PacedBackend(["late"], gap=2), max_concurrency=1, timeout=0.2)
+        started = time.monotonic()
+        with self.assertRaises(LLMTimeout):
+            list(gateway.stream("hello"))
+        self.assertLess(time.monotonic() - started, 1)
+        # The hung upstream call still holds its slot
+        with self.assertRaises(LLMBusy):
+            gateway.invoke("hello", timeout=0.05)
+
+    def test_stream_latency_does_not_set_hedge_delay(self):
+        gateway = LLMGateway(StubBackend(reply="a b"), hedge_min_samples=1)
+        list(gateway.stream("hello"))
+        self.assertIsNone(gateway.p95_latency())
+        gateway.invoke("hello")
+        self.assertIsNotNone(gateway.p95_latency())
+
+    def test_abandoned_call_keeps_its_slot(self):
+        gateway = LLMGateway(StubBackend(latency=0.3), max_concurrency=1, timeout=0.05, max_retries=0)
+        with self.assertRaises(LLMTimeout):
+            gateway.invoke("hello")
+        with self.assertRaises(LLMBusy):
+            gateway.invoke("hello")
+        time.sleep(0.3)
+        self.assertTrue(gateway.invoke("hello", timeout=1))
+
+
+class RetryAccountingTest(unittest.TestCase):
+    def test_retries_count_as_one_failure(self):
+        gateway = LLMGateway(
+            StubBackend(failure_rate=1.0),
+            max_retries=2,
+            backoff_base=0.001,
+            breaker=CircuitBreaker(failure_threshold=2)
+        )
+        with self.assertRaises(Exception):
+            gateway.invoke("hello")
+        self.assertEqual(gateway.breaker.failures, 1)
+        self.assertEqual(gateway.breaker.state, 'closed')
+
+
+if __name__ == '__main__':
+    unittest.main()
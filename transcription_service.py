@@ -0,0 +1,185 @@
+"""Shared Whisper transcription worker.
+
+A single process owns the Whisper model and serves every web worker over
+local IPC, so adding gunicorn workers does not multiply model memory.
+Requests wait in a bounded queue and are handed to the CTranslate2
+workers as soon as one is free, so a long recording only occupies its
+own worker.
+
+Run it next to the web app with a shared secret:
+
+    TRANSCRIBE_SERVICE_AUTHKEY=... python transcription_service.py
+
+and point the app at it with TRANSCRIBE_SERVICE_ADDRESS and the same
+TRANSCRIBE_SERVICE_AUTHKEY. Connections are authenticated with the key
+and carry raw audio bytes and JSON replies, never pickles.
+"""
+from multiprocessing.connection import Listener, Client
+from concurrent.futures import ThreadPoolExecutor
+import io
+import json
+import logging
+import os
+import queue
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# === Configuration ===
+SERVICE_ADDRESS = os.getenv('TRANSCRIBE_SERVICE_ADDRESS', 'localhost:6001')
+# No default: a well-known key would let any local process use the service
+SERVICE_AUTHKEY = os.getenv('TRANSCRIBE_SERVICE_AUTHKEY')
+WHISPER_MODEL_SIZE = os.getenv('WHISPER_MODEL_SIZE', 'base')
+WHISPER_CPU_THREADS = int(os.getenv('WHISPER_CPU_THREADS', '4'))  # CTranslate2 threads per worker
+WHISPER_NUM_WORKERS = int(os.getenv('WHISPER_NUM_WORKERS', '2'))  # Concurrent transcriptions
+QUEUE_SIZE = int(os.getenv('TRANSCRIBE_QUEUE_SIZE', '32'))
+MAX_AUDIO_BYTES = int(os.getenv('TRANSCRIBE_MAX_AUDIO_BYTES', str(50 * 1024 * 1024)))
+REQUEST_TIMEOUT = float(os.getenv('TRANSCRIBE_TIMEOUT', '120'))
+
+
+class TranscriptionError(Exception):
+    pass
+
+
+class TranscriptionBusy(TranscriptionError):
+    """Raised when the service queue is full."""
+
+
+def require_authkey(authkey):
+    if not authkey:
+        raise TranscriptionError("TRANSCRIBE_SERVICE_AUTHKEY must be set to use the transcription service")
+    return authkey.encode() if isinstance(authkey, str) else authkey
+
+
+def parse_address(address):
+    # "host:port" means TCP on the loopback interface, anything else is a unix socket path
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        return (host or 'localhost', int(port))
+    return address
+
+
+class _Job:
+    def __init__(self, audio):
+        self.audio = audio
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class TranscriptionServer:
+    def __init__(self, address=SERVICE_ADDRESS, authkey=SERVICE_AUTHKEY):
+        self.address = parse_address(address)
+        self.authkey = require_authkey(authkey)
+        self.jobs = queue.Queue(maxsize=QUEUE_SIZE)
+        self.executor = ThreadPoolExecutor(max_workers=WHISPER_NUM_WORKERS,
+                                           thread_name_prefix='whisper')
+        # One slot per worker; a job is only taken off the queue once a slot is free
+        self.slots = threading.BoundedSemaphore(WHISPER_NUM_WORKERS)
+        self.model = None
+
+    def load_model(self):
+        from faster_whisper import WhisperModel
+
+        logger.info(f"Loading Whisper model '{WHISPER_MODEL_SIZE}' "
+                    f"(cpu_threads={WHISPER_CPU_THREADS}, num_workers={WHISPER_NUM_WORKERS})")
+        self.model = WhisperModel(
+            WHISPER_MODEL_SIZE,
+            device="cpu",
+            compute_type="int8",
+            cpu_threads=WHISPER_CPU_THREADS,
+            num_workers=WHISPER_NUM_WORKERS
+        )
+        logger.info("Whisper model loaded")
+
+    def _transcribe(self, job):
+        try:
+            segments, _ = self.model.transcribe(io.BytesIO(job.audio))
+            job.result = " ".join([segment.text for segment in segments])
+        except Exception as e:
+            logger.error(f"Transcription failed: {str(e)}")
+            job.error = str(e)
+        finally:
+            self.slots.release()
+            job.done.set()
+
+    def _dispatch(self):
+        while True:
+            self.slots.acquire()
+            job = self.jobs.get()
+            self.executor.submit(self._transcribe, job)
+
+    @staticmethod
+    def _reply(conn, message):
+        conn.send_bytes(json.dumps(message).encode())
+
+    def _handle_connection(self, conn):
+        try:
+            job = _Job(conn.recv_bytes(MAX_AUDIO_BYTES))
+            try:
+                self.jobs.put_nowait(job)
+            except queue.Full:
+                self._reply(conn, {'error': 'Transcription queue is full', 'busy': True})
+                return
+            job.done.wait()
+            if job.error:
+                self._reply(conn, {'error': job.error})
+            else:
+                self._reply(conn, {'text': job.result})
+        except (EOFError, OSError) as e:
+            logger.debug(f"Client connection closed: {str(e)}")
+        finally:
+            conn.close()
+
+    def serve_forever(self):
+        if self.model is None:
+            self.load_model()
+        threading.Thread(target=self._dispatch, daemon=True).start()
+        with Listener(self.address, authkey=self.authkey) as listener:
+            logger.info(f"Transcription service listening on {self.address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    logger.error(f"Failed to accept connection: {str(e)}")
+                    continue
+                threading.Thread(target=self._handle_connection, args=(conn,), daemon=True).start()
+
+
+class TranscriptionClient:
+    def __init__(self, address=SERVICE_ADDRESS, authkey=SERVICE_AUTHKEY, timeout=REQUEST_TIMEOUT):
+        self.address = parse_address(address)
+        self.authkey = require_authkey(authkey)
+        self.timeout = timeout
+
+    def transcribe(self, audio):
+        """Transcribe a file path, file-like object or raw bytes."""
+        if isinstance(audio, str):
+            with open(audio, 'rb') as f:
+                audio = f.read()
+        elif hasattr(audio, 'read'):
+            audio = audio.read()
+
+        conn = Client(self.address, authkey=self.authkey)
+        try:
+            conn.send_bytes(bytes(audio))
+            if not conn.poll(self.timeout):
+                raise TranscriptionError('Timed out waiting for transcription')
+            response = json.loads(conn.recv_bytes())
+        finally:
+            conn.close()
+
+        if response.get('busy'):
+            raise TranscriptionBusy(response['error'])
+        if 'error' in response:
+            raise TranscriptionError(response['error'])
+        return response['text']
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    TranscriptionServer().serve_forever()
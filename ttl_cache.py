@@ -0,0 +1,41 @@
+"""Thread-safe LRU cache with per-entry expiry.
+
+Shared by the in-process caches (auth, chat history, dashboard). Each
+entry carries its own expiry time, given as a time.time() timestamp, and
+the least recently used entries are evicted beyond max_size.
+"""
+from collections import OrderedDict
+import threading
+import time
+
+
+class TTLCache:
+    """A small thread-safe LRU cache whose entries carry their own expiry."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
@@ -0,0 +1,168 @@
+"""Content-addressed on-disk cache for synthesized speech.
+
+Entries are keyed by a hash of (voice, audio format, text) and stored as
+<root>/<key[:2]>/<key>.mp3. The cache keeps an in-memory LRU index and
+evicts the least recently used files once the total size goes over the
+byte budget, so the responses directory no longer grows forever.
+
+Several worker processes can share one directory. The disk is the source
+of truth: a lookup that misses the local index adopts a file another
+worker wrote, and the byte budget is enforced against a fresh scan of the
+directory (at most sync_interval seconds old), ordered by the mtimes that
+every worker refreshes on a hit.
+"""
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# edge-tts 6.x always produces this output format
+AUDIO_FORMAT = "audio-24khz-48kbitrate-mono-mp3"
+
+
+class AudioCache:
+    def __init__(self, root, max_bytes, sync_interval=10):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.sync_interval = sync_interval
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._index = OrderedDict()  # key -> size, least recently used first
+        self._lock = threading.Lock()
+        self._last_sync = 0.0
+        self._loaded = False
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def make_key(text, voice, audio_format=AUDIO_FORMAT):
+        digest = hashlib.sha256()
+        for part in (voice, audio_format, text):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.mp3")
+
+    def _scan(self):
+        # (mtime, key, size) for every cached file, least recently used first
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not name.endswith('.mp3'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(dirpath, name))
+                except OSError:
+                    continue  # Evicted by another worker meanwhile
+                entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        return sorted(entries)
+
+    def _sync(self):
+        """Replace the index with what is on disk, including other workers' files."""
+        entries = self._scan()
+        with self._lock:
+            self._index = OrderedDict((key, size) for _, key, size in entries)
+            self.total_bytes = sum(size for _, _, size in entries)
+            self._last_sync = time.monotonic()
+
+    def _load_index(self):
+        # Rebuild the LRU order from modification times left by earlier runs.
+        # Done on first use rather than in __init__, since it walks the directory.
+        if self._loaded:
+            return
+        self._loaded = True
+        self._sync()
+        if self._index:
+            logger.info(f"Loaded {len(self._index)} cached audio files ({self.total_bytes} bytes)")
+        self._enforce_budget()
+
+    def get(self, text, voice):
+        """Return the path of the cached audio, or None on a miss."""
+        self._load_index()
+        key = self.make_key(text, voice)
+        path = self._path(key)
+        with self._lock:
+            known = key in self._index
+            if known:
+                self._index.move_to_end(key)
+        if not known:
+            # Possibly written by another worker since our last sync
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                with self._lock:
+                    self.misses += 1
+                return None
+            with self._lock:
+                if key not in self._index:
+                    self._index[key] = size
+                    self.total_bytes += size
+        try:
+            os.utime(path)  # Shared recency: across restarts and workers
+        except OSError:
+            # Evicted by another worker
+            with self._lock:
+                self.total_bytes -= self._index.pop(key, 0)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def put(self, text, voice, audio):
+        self._load_index()
+        key = self.make_key(text, voice)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary name first so readers never see partial files
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(audio)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.total_bytes -= self._index.pop(key, 0)
+            self._index[key] = len(audio)
+            self.total_bytes += len(audio)
+            over_budget = self.total_bytes > self.max_bytes
+            sync_due = time.monotonic() - self._last_sync > self.sync_interval
+        if over_budget or sync_due:
+            self._enforce_budget(keep=key)
+        return path
+
+    def _enforce_budget(self, keep=None):
+        # Other workers write into the same directory, so measure the disk
+        # rather than trusting this process's running total
+        self._sync()
+        with self._lock:
+            if keep in self._index:
+                # Just written; its path was handed to the caller
+                self._index.move_to_end(keep)
+            # The most recent entry is always kept so a path returned by put() stays valid
+            while self.total_bytes > self.max_bytes and len(self._index) > 1:
+                key, size = self._index.popitem(last=False)
+                self.total_bytes -= size
+                self.evictions += 1
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+
+    def stats(self):
+        self._load_index()
+        with self._lock:
+            return {
+                'entries': len(self._index),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
@@ -0,0 +1,173 @@
+"""Edge-TTS synthesis on a long-lived background event loop.
+
+Flask handlers are synchronous, so instead of spinning up a fresh event
+loop with asyncio.run() for every reply they submit work to a single loop
+running on a daemon thread and wait on the returned futures. A semaphore
+on that loop caps how many syntheses run at once. When an AudioCache is
+attached, cached phrases are served from disk and new syntheses are
+stored once they complete.
+
+The loop thread is started on first use in the process that uses it, so
+creating the service at import time is cheap and safe across a
+pre-fork server.
+"""
+import asyncio
+import logging
+import os
+import queue
+import threading
+
+import edge_tts
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VOICE = "en-US-JennyNeural"
+_DONE = object()
+
+
+class CachedSpeech:
+    """Iterates over audio already stored in the cache."""
+
+    def __init__(self, path, chunk_size=16384):
+        self.path = path
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def cancel(self):
+        pass
+
+
+class SpeechStream:
+    """An in-flight synthesis whose MP3 chunks can be iterated synchronously.
+
+    Synthesis starts as soon as the stream is created, so several streams
+    can be opened ahead of time and consumed in order.
+    """
+
+    def __init__(self, service, text, voice):
+        self._chunks = queue.Queue()
+        self._timeout = service.timeout
+        self.cached_path = None
+        self.future = service.submit(self._run(service, text, voice))
+
+    async def _run(self, service, text, voice):
+        try:
+            audio = []
+            async with service.semaphore:
+                communicate = edge_tts.Communicate(text, voice=voice)
+                async for chunk in communicate.stream():
+                    if chunk["type"] == "audio":
+                        audio.append(chunk["data"])
+                        self._chunks.put(chunk["data"])
+            if service.cache is not None:
+                self.cached_path = await asyncio.get_running_loop().run_in_executor(
+                    None, service.cache.put, text, voice, b"".join(audio))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error in text-to-speech conversion: {str(e)}")
+            self._chunks.put(e)
+        finally:
+            self._chunks.put(_DONE)
+
+    def __iter__(self):
+        try:
+            while True:
+                try:
+                    item = self._chunks.get(timeout=self._timeout)
+                except queue.Empty:
+                    raise TimeoutError('Timed out waiting for synthesized audio')
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.cancel()
+
+    def cancel(self):
+        # A no-op once the synthesis has finished
+        self.future.cancel()
+
+
+class TTSService:
+    def __init__(self, max_concurrent=4, timeout=60, cache=None):
+        self.timeout = timeout
+        self.cache = cache
+        self.max_concurrent = max_concurrent
+        self.loop = None
+        self.semaphore = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        # A loop inherited through fork has no thread behind it; start a new one
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self.loop = asyncio.new_event_loop()
+            threading.Thread(target=self._run_loop, name='tts-loop', daemon=True).start()
+            # The semaphore has to be created on the loop that will use it
+            self.semaphore = asyncio.run_coroutine_threadsafe(
+                self._create_semaphore(self.max_concurrent), self.loop).result()
+            self._pid = os.getpid()
+
+    async def _create_semaphore(self, value):
+        return asyncio.Semaphore(value)
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """Schedule a coroutine on the TTS loop and return a concurrent.futures.Future.
+
+        Cancelling the future cancels the underlying task.
+        """
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stream(self, text, voice=DEFAULT_VOICE):
+        if self.cache is not None:
+            path = self.cache.get(text, voice)
+            if path:
+                return CachedSpeech(path)
+        return SpeechStream(self, text, voice)
+
+    def synthesize(self, text, voice=DEFAULT_VOICE):
+        return b"".join(self.stream(text, voice))
+
+    def synthesize_to_cache(self, text, voice=DEFAULT_VOICE):
+        """Return the cached audio path for text, synthesizing it on a miss."""
+        path = self.cache.get(text, voice)
+        if path:
+            return path
+        speech = SpeechStream(self, text, voice)
+        for _ in speech:
+            pass
+        return speech.cached_path
+
+    def prewarm(self, phrases, voice=DEFAULT_VOICE):
+        """Synthesize canned phrases in the background so they are cache hits."""
+        def run():
+            for phrase in phrases:
+                try:
+                    self.synthesize_to_cache(phrase, voice)
+                except Exception as e:
+                    logger.warning(f"Failed to pre-warm TTS cache: {str(e)}")
+            logger.info(f"Pre-warmed TTS cache with {len(phrases)} phrases")
+
+        threading.Thread(target=run, name='tts-prewarm', daemon=True).start()
+
+    def shutdown(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)